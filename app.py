@@ -1,155 +1,501 @@
+import hashlib
+import hmac
+import multiprocessing
 import os
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+import secrets
+from datetime import date, datetime, timedelta
+from functools import partial
+import click
+from flask.cli import with_appcontext
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, flash, session, abort, jsonify, make_response
+from sqlalchemy import case, insert, type_coerce, update
+from sqlalchemy.orm import joinedload
+from werkzeug.http import is_resource_modified
+from models import db, Cliente, Produto, Pedido, ItemPedido, Pagamento, AlteracaoCatalogo
+from catalogo_cache import CatalogoCache
+from catalogo_padrao import popular_catalogo, compactar_alteracoes
+from carrinho_store import Carrinho, criar_carrinho_store
+from senhas import PoolSenhasOcupado, criar_pool_senhas
+from assets import carregar_manifesto, construir_assets, servir_asset
+from metricas import exportar_metricas, instalar_metricas
+from pagamentos import enfileirar, executar_worker
+from relatorios import registrar_venda, reconstruir_vendas, receita_por_dia, mais_vendidos, estoque_baixo, para_csv
+from busca import criar_indice_busca, buscar_ids
+from banco import carregar_perfil, opcoes_engine, registrar_pragmas, migrar
 
-# Config
 basedir = os.path.abspath(os.path.dirname(__file__))
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'trabalho-final-flask-ecommerce'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'loja.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-
-# Banco de dados
-
-class Cliente(db.Model):
-    __tablename__ = 'clientes'
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(100), unique=True, nullable=False)
-    senha_hash = db.Column(db.String(255), nullable=False)
-    telefone = db.Column(db.String(20))
-    pedidos = db.relationship('Pedido', backref='cliente', lazy=True)
-
-    def set_senha(self, senha):
-        self.senha_hash = generate_password_hash(senha)
-
-    def check_senha(self, senha):
-        return check_password_hash(self.senha_hash, senha)
-
-
-class Produto(db.Model):
-    __tablename__ = 'produtos'
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(100), nullable=False)
-    descricao = db.Column(db.Text)
-    preco = db.Column(db.Numeric(10, 2), nullable=False)
-    estoque = db.Column(db.Integer, nullable=False, default=0)
-    imagem_url = db.Column(db.String(500), nullable=True)
-
-
-class Pedido(db.Model):
-    __tablename__ = 'pedidos'
-    id = db.Column(db.Integer, primary_key=True)
-    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
-    data = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.String(20), default='pendente')
-    itens = db.relationship('ItemPedido', backref='pedido', lazy=True)
-    pagamento = db.relationship('Pagamento', backref='pedido', uselist=False, lazy=True)
-
-
-class ItemPedido(db.Model):
-    __tablename__ = 'itens_pedido'
-    id = db.Column(db.Integer, primary_key=True)
-    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id'), nullable=False)
-    produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id'), nullable=False)
-    quantidade = db.Column(db.Integer, nullable=False)
-    preco_unitario = db.Column(db.Numeric(10, 2), nullable=False)
-    produto = db.relationship('Produto', lazy=True)
-
-
-class Pagamento(db.Model):
-    __tablename__ = 'pagamentos'
-    id = db.Column(db.Integer, primary_key=True)
-    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id'), nullable=False)
-    tipo = db.Column(db.String(50))
-    valor = db.Column(db.Numeric(10, 2), nullable=False)
-    status = db.Column(db.String(20), default='aguardando')
-
-
-with app.app_context():
-    db.create_all()
+bp = Blueprint('loja', __name__)
 
-    print("\n🗑️ Limpando catálogo antigo...")
-    Produto.query.delete()
-    db.session.commit()
 
-    print("📦 Recriando catálogo de produtos...")
-
-    produtos_padrao = [
-        Produto(
-            nome="Camisa Blessed Streetwear",
-            descricao="Uma camiseta de algodão confortável",
-            preco=79.90,
-            estoque=50,
-            imagem_url="https://down-br.img.susercontent.com/file/sg-11134201-7rat0-mayzkhimuclt34@resize_w450_nl.webp"
-        ),
-        Produto(
-            nome="Camisas Oversized Astronauta",
-            descricao="Apresentamos a Camiseta Unissex Oversized, confeccionada em 100% algodão. Com um corte amplo e folgado, essa peça é fabricada com materiais de alta qualidade, garantindo durabilidade excepcional. ",
-            preco=79.90,
-            estoque=100,
-            imagem_url="https://down-br.img.susercontent.com/file/br-11134207-7r98p-llwc0bzzkx6e33.webp"
-        ),
-        Produto(
-            nome="Bermuda Short Osascorte",
-            descricao="Short",
-            preco=50.00,
-            estoque=30,
-            imagem_url="https://down-br.img.susercontent.com/file/br-11134207-7r98o-m4rtb8evd2v55c.webp"
-        ),
-        Produto(
-            nome="Short Bermuda Exclusive",
-            descricao="Apresentamos a você o nosso incrível Short ",
-            preco=55.00,
-            estoque=30,
-            imagem_url="https://down-br.img.susercontent.com/file/sg-11134201-7rfgy-m9uvb7pjp4mh94.webp"
-        ),
-    ]
+# Config
 
-    db.session.add_all(produtos_padrao)
+def create_app(config=None):
+    """Cria a aplicação. Não toca no banco: criar tabelas, migrar e popular
+    o catálogo são passos explícitos (`flask migrar`, `flask popular-catalogo`),
+    então cada worker sobe rápido e nenhum deles apaga dados ao iniciar."""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('STYLEME_SECRET_KEY', 'trabalho-final-flask-ecommerce')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'STYLEME_DATABASE_URI', 'sqlite:///' + os.path.join(basedir, 'loja.db'))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['BANCO_PERFIL'] = os.environ.get('STYLEME_BANCO_PERFIL', 'producao')
+    app.config['CATALOGO_CACHE_MAX_ITENS'] = 512
+    app.config['CATALOGO_POR_PAGINA'] = 24
+    app.config['CATALOGO_LIMITE_MAXIMO'] = 100
+    # 'sqlite' é compartilhado entre workers; 'memoria' só serve para um processo
+    app.config['CARRINHO_BACKEND'] = os.environ.get('STYLEME_CARRINHO_BACKEND', 'sqlite')
+    app.config['CARRINHO_TTL_SEGUNDOS'] = 7 * 24 * 3600
+    app.config['CARRINHO_MAX_MEMORIA'] = 10000
+    # Hash de senha: parâmetros no formato do werkzeug ("scrypt:N:r:p" ou
+    # "pbkdf2:sha256:iterações"). Hashes com outros parâmetros são refeitos
+    # no próximo login. SENHA_PROCESSOS=0 faz o hash na thread do request.
+    app.config['SENHA_METODO'] = 'scrypt:32768:8:1'
+    app.config['SENHA_PROCESSOS'] = int(os.environ.get('STYLEME_SENHA_PROCESSOS', 2))
+    app.config['SENHA_MAX_PENDENTES'] = None
+    app.config['SENHA_ESPERA_MAXIMA'] = 2.0
+    # Instrumentação por request exposta em /metrics. METRICAS_LENTO_MS liga o
+    # log de requests lentos; METRICAS_CABECALHO adiciona o Server-Timing.
+    app.config['METRICAS_ATIVAS'] = True
+    app.config['METRICAS_LENTO_MS'] = None
+    app.config['METRICAS_CABECALHO'] = False
+    # Com vários workers, um diretório compartilhado por eles; /metrics soma
+    # os arquivos de todos. Sem ele, cada scrape vê só o worker que respondeu.
+    app.config['METRICAS_DIRETORIO'] = os.environ.get('STYLEME_METRICAS_DIR')
+    app.config['METRICAS_INTERVALO_GRAVACAO'] = 1.0
+    # Cobrança assíncrona: o checkout só enfileira; `flask processar-pagamentos`
+    # chama o gateway (qualquer subclasse de pagamentos.Gateway)
+    app.config['PAGAMENTO_GATEWAY'] = os.environ.get('STYLEME_PAGAMENTO_GATEWAY', 'pagamentos.GatewayLocal')
+    app.config['PAGAMENTO_LOTE'] = 20
+    app.config['PAGAMENTO_LEASE_SEGUNDOS'] = 120
+    app.config['PAGAMENTO_MAX_TENTATIVAS'] = 5
+    app.config['PAGAMENTO_ESPERA_BASE'] = 5
+    app.config['PAGAMENTO_ESPERA_MAXIMA'] = 300
+    # /relatorios só responde quando há um token configurado
+    app.config['RELATORIOS_TOKEN'] = os.environ.get('STYLEME_RELATORIOS_TOKEN')
+    app.config['RELATORIOS_DIAS_PADRAO'] = 30
+    app.config['RELATORIOS_ESTOQUE_BAIXO'] = 5
+    if config:
+        app.config.update(config)
+
+    perfil_banco = carregar_perfil(app.config['BANCO_PERFIL'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          opcoes_engine(app.config['SQLALCHEMY_DATABASE_URI'], perfil_banco))
+
+    db.init_app(app)
+    with app.app_context():
+        # Só cria o engine; nenhuma conexão é aberta antes do fork dos workers
+        registrar_pragmas(db.engine, perfil_banco)
+        if app.config['METRICAS_ATIVAS']:
+            instalar_metricas(app, db.engine)
+
+    app.extensions['catalogo_cache'] = CatalogoCache(max_itens=app.config['CATALOGO_CACHE_MAX_ITENS'])
+    app.extensions['carrinho_store'] = criar_carrinho_store(app.config)
+    app.extensions['senhas'] = criar_pool_senhas(app.config)
+    if 'metricas' in app.extensions:
+        metricas = app.extensions['metricas']
+        metricas.histogramas.append(app.extensions['senhas'].latencia)
+        metricas.coletores += [partial(_metricas_catalogo, app.extensions['catalogo_cache']),
+                               partial(_metricas_senhas, app.extensions['senhas'])]
+    app.extensions['assets'] = carregar_manifesto(app.static_folder)
+    app.config.setdefault('VERSAO_SITE', _versao_site(app))
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.register_blueprint(bp)
+    app.cli.add_command(migrar_comando)
+    app.cli.add_command(popular_catalogo_comando)
+    app.cli.add_command(expirar_carrinhos_comando)
+    app.cli.add_command(compactar_alteracoes_comando)
+    app.cli.add_command(assets_comando)
+    app.cli.add_command(processar_pagamentos_comando)
+    app.cli.add_command(reconstruir_vendas_comando)
+    return app
+
+
+def _versao_site(app):
+    # Muda a cada deploy que altera templates ou assets; entra no ETag das
+    # páginas para que um HTML antigo nunca seja revalidado como atual
+    sha = hashlib.sha1(repr(sorted(app.extensions['assets'].items())).encode())
+    for raiz, _, arquivos in sorted(os.walk(os.path.join(app.root_path, app.template_folder))):
+        for nome in sorted(arquivos):
+            with open(os.path.join(raiz, nome), 'rb') as arquivo:
+                sha.update(arquivo.read())
+    return sha.hexdigest()[:12]
+
+
+def asset_url(arquivo):
+    # Sem `flask assets` rodado (desenvolvimento), usa o arquivo original
+    final = current_app.extensions['assets'].get(arquivo)
+    if final is None:
+        return url_for('static', filename=arquivo)
+    return url_for('loja.asset', arquivo=final)
+
+
+def _app_do_worker():
+    # Precisa ser uma função de módulo para ser enviada aos processos filhos
+    return create_app()
+
+
+def preparar_banco():
+    db.create_all()
+    aplicadas = migrar(db)
+    criar_indice_busca(db)
+    return aplicadas
+
+
+@click.command('migrar')
+@with_appcontext
+def migrar_comando():
+    """Cria as tabelas e aplica as migrações pendentes."""
+    aplicadas = preparar_banco()
+    for versao, descricao in aplicadas:
+        print(f"✅ Migração {versao} aplicada: {descricao}")
+    if not aplicadas:
+        print("Banco já está na versão mais recente.")
+
+
+@click.command('popular-catalogo')
+@click.option('--repor-estoque', is_flag=True, help='Volta o estoque dos produtos padrão ao valor inicial.')
+@with_appcontext
+def popular_catalogo_comando(repor_estoque):
+    """Insere ou atualiza o catálogo padrão (pode rodar mais de uma vez)."""
+    total = popular_catalogo(repor_estoque=repor_estoque)
+    _cache().invalidar()
+    print(f"✅ Catálogo atualizado: {total} produtos.")
+
+
+@click.command('expirar-carrinhos')
+@with_appcontext
+def expirar_carrinhos_comando():
+    """Remove carrinhos abandonados há mais que CARRINHO_TTL_SEGUNDOS."""
+    removidos = _carrinhos().expirar()
     db.session.commit()
-
-    print("✅ Catálogo atualizado com sucesso!\n")
+    print(f"🗑️ Carrinhos expirados removidos: {removidos}.")
+
+
+@click.command('compactar-alteracoes')
+@click.option('--manter', default=1000, show_default=True, help='Alterações mais recentes que continuam no registro.')
+@with_appcontext
+def compactar_alteracoes_comando(manter):
+    """Encolhe catalogo_alteracoes, que cresce a cada checkout e cancelamento."""
+    removidas = compactar_alteracoes(manter)
+    print(f"🗑️ Alterações do catálogo removidas: {removidas}.")
+
+
+@click.command('assets')
+@with_appcontext
+def assets_comando():
+    """Gera em static/dist as cópias com hash no nome e as versões .gz/.br."""
+    manifesto = construir_assets(current_app.static_folder)
+    for original, final in sorted(manifesto.items()):
+        print(f"📦 {original} -> {final}")
+
+
+@click.command('reconstruir-vendas')
+@click.option('--lote', default=1000, show_default=True, help='Pedidos somados por transação.')
+@with_appcontext
+def reconstruir_vendas_comando(lote):
+    """Recalcula vendas_diarias a partir de todo o histórico de pedidos."""
+    for ultimo_pedido in reconstruir_vendas(lote):
+        print(f"📊 Pedidos até #{ultimo_pedido} somados")
+    print("✅ Vendas reconstruídas.")
+
+
+@click.command('processar-pagamentos')
+@click.option('--workers', default=1, show_default=True, help='Processos processando a fila em paralelo.')
+@click.option('--intervalo', default=1.0, show_default=True, help='Segundos de espera quando a fila está vazia.')
+@click.option('--uma-vez', is_flag=True, help='Esvazia a fila e termina, em vez de ficar esperando.')
+def processar_pagamentos_comando(workers, intervalo, uma_vez):
+    """Cobra os pagamentos pendentes pelo gateway configurado."""
+    if workers == 1:
+        executar_worker(_app_do_worker, intervalo, uma_vez)
+        return
+
+    processos = [multiprocessing.Process(target=executar_worker, args=(_app_do_worker, intervalo, uma_vez))
+                 for _ in range(workers)]
+    for processo in processos:
+        processo.start()
+    try:
+        for processo in processos:
+            processo.join()
+    except KeyboardInterrupt:
+        for processo in processos:
+            processo.terminate()
+        for processo in processos:
+            processo.join()
+
+
+# Cache do catálogo
+# Guardamos cópias simples (dict) e não objetos do ORM, que ficam expirados
+# ou desanexados da sessão depois do fim do request.
+
+def _produto_para_dict(produto):
+    return {
+        'id': produto.id,
+        'nome': produto.nome,
+        'descricao': produto.descricao,
+        'preco': produto.preco,
+        'estoque': produto.estoque,
+        'imagem_url': produto.imagem_url,
+    }
+
+
+def _carregar_pagina(depois, limite):
+    # Paginação por chave (id > depois) em vez de OFFSET: o custo de cada
+    # página é o mesmo, não importa quão longe ela esteja no catálogo.
+    # Buscamos um item a mais só para saber se existe próxima página.
+    produtos = (Produto.query
+                .filter(Produto.id > depois)
+                .order_by(Produto.id)
+                .limit(limite + 1)
+                .all())
+    return _montar_pagina(produtos, limite)
+
+
+def _montar_pagina(produtos, limite):
+    itens = [_produto_para_dict(p) for p in produtos[:limite]]
+    proximo = itens[-1]['id'] if len(produtos) > limite else None
+    return {'produtos': itens, 'proximo': proximo}
+
+
+def _limite_pagina():
+    limite = request.args.get('limit', current_app.config['CATALOGO_POR_PAGINA'], type=int)
+    return min(max(limite, 1), current_app.config['CATALOGO_LIMITE_MAXIMO'])
+
+
+def _parametros_pagina():
+    depois = max(request.args.get('after', 0, type=int), 0)
+    return depois, _limite_pagina()
+
+
+def _carregar_produto(id):
+    produto = db.session.get(Produto, id)
+    return _produto_para_dict(produto) if produto else None
+
+
+def _cache():
+    return current_app.extensions['catalogo_cache']
+
+
+def _sincronizar_cache():
+    # Aplica no cache deste processo as alterações feitas por outros workers.
+    # É uma leitura por chave primária que quase sempre volta vazia.
+    cache = _cache()
+    if cache.ultima_alteracao is None:
+        cache.ultima_alteracao = db.session.query(db.func.max(AlteracaoCatalogo.id)).scalar() or 0
+        return
+
+    alteracoes = (db.session.query(AlteracaoCatalogo.id, AlteracaoCatalogo.produto_id)
+                  .filter(AlteracaoCatalogo.id > cache.ultima_alteracao)
+                  .order_by(AlteracaoCatalogo.id)
+                  .all())
+    if not alteracoes:
+        return
+    if any(produto_id is None for _, produto_id in alteracoes):
+        cache.invalidar()
+    else:
+        invalidar_produtos({produto_id for _, produto_id in alteracoes})
+    cache.ultima_alteracao = alteracoes[-1][0]
+
+
+def invalidar_produtos(produto_ids):
+    chaves = [('produto', pid) for pid in produto_ids]
+    _cache().invalidar_grupo('catalogo', *chaves)
+
+
+def _pagina_catalogo(renderizar):
+    # Para visitantes anônimos sem mensagens pendentes, o HTML só depende da
+    # URL e da versão do catálogo. O ETag junta as duas (e a versão do site),
+    # então uma revisita responde 304 sem consultar o banco nem o Jinja.
+    # Deve ser chamada depois de _sincronizar_cache().
+    if 'cliente_id' in session or '_flashes' in session:
+        return renderizar()
+
+    cache = _cache()
+    chave = f"{current_app.config['VERSAO_SITE']}:{cache.ultima_alteracao}:{request.full_path}"
+    etag = hashlib.sha1(chave.encode()).hexdigest()[:20]
+
+    if is_resource_modified(request.environ, etag=etag, last_modified=cache.alterado_em):
+        resposta = make_response(renderizar())
+    else:
+        resposta = current_app.response_class(status=304)
+    resposta.set_etag(etag)
+    resposta.last_modified = cache.alterado_em
+    # Pode guardar, mas sempre revalida: o estoque mostrado precisa ser o atual
+    resposta.cache_control.no_cache = True
+    return resposta
 
 
 # Rotas
 
-@app.route('/')
+@bp.route('/')
 def index():
-    produtos = Produto.query.all()
-    return render_template('index.html', produtos=produtos)
+    depois, limite = _parametros_pagina()
+    _sincronizar_cache()
+
+    def renderizar():
+        pagina = _cache().obter(('catalogo', depois, limite), lambda: _carregar_pagina(depois, limite))
+        return render_template('index.html', produtos=pagina['produtos'], proximo=pagina['proximo'], limite=limite)
+
+    return _pagina_catalogo(renderizar)
 
 
-@app.route('/produto/<int:id>')
+@bp.route('/busca')
+def busca():
+    termo = request.args.get('q', '').strip()
+    if not termo:
+        return redirect(url_for('loja.index'))
+
+    depois, limite = _parametros_pagina()
+    _sincronizar_cache()
+
+    def renderizar():
+        ids = buscar_ids(db, termo, depois=depois, limite=limite + 1)
+        produtos = Produto.query.filter(Produto.id.in_(ids)).order_by(Produto.id).all() if ids else []
+        pagina = _montar_pagina(produtos, limite)
+        return render_template('index.html', produtos=pagina['produtos'], proximo=pagina['proximo'],
+                               limite=limite, termo=termo)
+
+    return _pagina_catalogo(renderizar)
+
+
+@bp.route('/produto/<int:id>')
 def detalhes_produto(id):
-    produto = Produto.query.get_or_404(id)
-    return render_template('produto.html', produto=produto)
+    _sincronizar_cache()
+    produto = _cache().obter(('produto', id), lambda: _carregar_produto(id))
+    if produto is None:
+        abort(404)
+    return _pagina_catalogo(lambda: render_template('produto.html', produto=produto))
+
+
+@bp.route('/assets/<path:arquivo>')
+def asset(arquivo):
+    return servir_asset(current_app.static_folder, arquivo, request.accept_encodings)
+
+
+@bp.route('/cache/catalogo')
+def estatisticas_cache():
+    return jsonify(_cache().estatisticas())
+
+
+@bp.route('/senhas/estatisticas')
+def estatisticas_senhas():
+    return jsonify(current_app.extensions['senhas'].estatisticas())
+
+
+def _metricas_catalogo(cache):
+    extras = []
+    for nome, valor in cache.estatisticas().items():
+        if nome in ('hits', 'misses', 'evictions'):
+            extras.append((f'styleme_catalogo_cache_{nome}_total', 'counter', f'Cache do catálogo: {nome}.', valor))
+        elif nome == 'itens':
+            extras.append(('styleme_catalogo_cache_itens', 'gauge', 'Entradas no cache do catálogo.', valor))
+    return extras
+
+
+def _metricas_senhas(pool):
+    senhas = pool.estatisticas()
+    return [
+        ('styleme_senha_pendentes', 'gauge', 'Hashes de senha na fila ou em execução.', senhas['pendentes']),
+        ('styleme_senha_rejeitados_total', 'counter', 'Hashes recusados por fila cheia.', senhas['rejeitados']),
+        ('styleme_senha_concluidos_total', 'counter', 'Hashes de senha concluídos.', senhas['concluidos']),
+    ]
+
+
+@bp.route('/metrics')
+def metricas():
+    if 'metricas' not in current_app.extensions:
+        abort(404)
+
+    return exportar_metricas(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def _data_parametro(nome, padrao):
+    valor = request.args.get(nome)
+    if not valor:
+        return padrao
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        abort(400, f"Parâmetro '{nome}' deve estar no formato AAAA-MM-DD.")
+
+
+@bp.route('/relatorios')
+def relatorios():
+    token = current_app.config['RELATORIOS_TOKEN']
+    if not token:
+        abort(404)
+    enviado = request.headers.get('Authorization', '').removeprefix('Bearer ') or request.args.get('token', '')
+    if not hmac.compare_digest(enviado.encode(), token.encode()):
+        abort(403)
+
+    fim = _data_parametro('fim', datetime.utcnow().date())
+    inicio = _data_parametro('inicio', fim - timedelta(days=current_app.config['RELATORIOS_DIAS_PADRAO'] - 1))
+    if inicio > fim:
+        abort(400, "'inicio' deve ser anterior a 'fim'.")
+    limite = _limite_pagina()
+    limiar = request.args.get('estoque_ate', current_app.config['RELATORIOS_ESTOQUE_BAIXO'], type=int)
+
+    secoes = {
+        'receita': lambda: receita_por_dia(inicio, fim),
+        'mais_vendidos': lambda: mais_vendidos(inicio, fim, limite),
+        'estoque_baixo': lambda: estoque_baixo(limiar, limite),
+    }
+
+    if request.args.get('formato') == 'csv':
+        secao = request.args.get('secao', 'receita')
+        if secao not in secoes:
+            abort(400, f"'secao' deve ser uma de: {', '.join(secoes)}.")
+        return para_csv(secoes[secao]()), 200, {
+            'Content-Type': 'text/csv; charset=utf-8',
+            'Content-Disposition': f'attachment; filename={secao}_{inicio}_{fim}.csv',
+        }
+
+    return jsonify({'inicio': inicio.isoformat(), 'fim': fim.isoformat(),
+                    **{nome: consulta() for nome, consulta in secoes.items()}})
 
 
+def _pool_ocupado(template):
+    flash('Muitos acessos no momento. Tente novamente em instantes.', 'warning')
+    return render_template(template), 503, {'Retry-After': '2'}
 
 
-@app.route('/login', methods=['GET', 'POST'])
+
+
+def _atualizar_hash(cliente, senha):
+    # Com a senha em mãos, refaz hashes gerados com parâmetros antigos.
+    # Se a fila estiver cheia fica para o próximo login.
+    if not cliente.senha_desatualizada():
+        return
+    try:
+        cliente.set_senha(senha)
+        db.session.commit()
+    except PoolSenhasOcupado:
+        pass
+
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
         senha = request.form.get('senha')
         cliente = Cliente.query.filter_by(email=email).first()
-        if cliente and cliente.check_senha(senha):
+        try:
+            senha_ok = cliente is not None and cliente.check_senha(senha)
+        except PoolSenhasOcupado:
+            return _pool_ocupado('login.html')
+
+        if senha_ok:
+            _atualizar_hash(cliente, senha)
             session['cliente_id'] = cliente.id
             session['cliente_nome'] = cliente.nome
             flash('Login bem-sucedido!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('loja.index'))
         else:
             flash('Email ou senha inválidos.', 'danger')
-            return redirect(url_for('login'))
+            return redirect(url_for('loja.login'))
     return render_template('login.html')
 
 
-@app.route('/registrar', methods=['GET', 'POST'])
+@bp.route('/registrar', methods=['GET', 'POST'])
 def registrar():
     if request.method == 'POST':
         nome = request.form.get('nome')
@@ -159,175 +505,230 @@ def registrar():
 
         if Cliente.query.filter_by(email=email).first():
             flash('Este email já está cadastrado.', 'danger')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('loja.registrar'))
 
         novo_cliente = Cliente(nome=nome, email=email, telefone=telefone)
-        novo_cliente.set_senha(senha)
+        try:
+            novo_cliente.set_senha(senha)
+        except PoolSenhasOcupado:
+            return _pool_ocupado('registrar.html')
 
         try:
             db.session.add(novo_cliente)
             db.session.commit()
             flash('Cadastro realizado com sucesso! Faça o login.', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('loja.login'))
         except Exception as e:
             db.session.rollback()
             flash(f'Erro ao cadastrar: {str(e)}', 'danger')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('loja.registrar'))
 
     return render_template('registrar.html')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.pop('cliente_id', None)
     session.pop('cliente_nome', None)
     flash('Você foi desconectado.', 'info')
-    return redirect(url_for('index'))
-
-
+    return redirect(url_for('loja.index'))
 
 
-@app.route('/carrinho', methods=['GET', 'POST'])
-def carrinho():
-    if request.method == 'POST':
-        produto_id = request.form.get('produto_id')
-        quantidade = int(request.form.get('quantidade'))
-        produto = Produto.query.get(produto_id)
 
-        if not produto:
-            flash('Produto não encontrado.', 'danger')
-            return redirect(url_for('index'))
-
-        if 'carrinho' not in session:
-            session['carrinho'] = {}
-
-        produto_id_str = str(produto_id)
-
-        if produto_id_str in session['carrinho']:
-            session['carrinho'][produto_id_str]['quantidade'] += quantidade
-        else:
-            session['carrinho'][produto_id_str] = {
-                'nome': produto.nome,
-                'preco': float(produto.preco),
-                'quantidade': quantidade
-            }
 
-        session.modified = True
-        flash(f'"{produto.nome}" adicionado ao carrinho!', 'success')
-        return redirect(url_for('carrinho'))
+def _carrinhos():
+    return current_app.extensions['carrinho_store']
 
-    itens_carrinho_session = session.get('carrinho', {})
-    total_carrinho = 0
-    itens_para_template = []
 
-    for pid, item in itens_carrinho_session.items():
-        subtotal = item['preco'] * item['quantidade']
-        itens_para_template.append({
-            'produto_id': pid,
-            'nome_produto': item['nome'],
-            'preco_unitario': item['preco'],
-            'quantidade': item['quantidade'],
-            'subtotal': subtotal
-        })
-        total_carrinho += subtotal
+def _carrinho_id(criar=False):
+    carrinho_id = session.get('carrinho_id')
+    if carrinho_id is None and criar:
+        carrinho_id = session['carrinho_id'] = secrets.token_hex(16)
+    return carrinho_id
 
-    return render_template('carrinho.html', itens_carrinho=itens_para_template, total_carrinho=total_carrinho)
 
+def _carrinho_atual():
+    carrinho_id = _carrinho_id()
+    return _carrinhos().obter(carrinho_id) if carrinho_id else Carrinho({})
 
 
+@bp.route('/carrinho', methods=['GET', 'POST'])
+def carrinho():
+    if request.method == 'POST':
+        produto_id = request.form.get('produto_id', type=int)
+        quantidade = int(request.form.get('quantidade'))
+        # Nome e preço vão para o carrinho, então precisam estar atualizados
+        _sincronizar_cache()
+        produto = _cache().obter(('produto', produto_id), lambda: _carregar_produto(produto_id)) if produto_id else None
 
-@app.route('/checkout', methods=['GET', 'POST'])
+        if not produto:
+            flash('Produto não encontrado.', 'danger')
+            return redirect(url_for('loja.index'))
+
+        _carrinhos().adicionar(_carrinho_id(criar=True), produto['id'], produto['nome'], produto['preco'], quantidade)
+        db.session.commit()
+
+        flash(f'"{produto["nome"]}" adicionado ao carrinho!', 'success')
+        return redirect(url_for('loja.carrinho'))
+
+    carrinho_atual = _carrinho_atual()
+    return render_template('carrinho.html', itens_carrinho=carrinho_atual.itens, total_carrinho=carrinho_atual.total)
+
+
+def reservar_estoque(quantidades):
+    # Uma única UPDATE condicional para o carrinho inteiro: cada linha só é
+    # decrementada se ainda houver estoque suficiente. Se alguma não foi
+    # atualizada, outro pedido levou o estoque antes e a transação é desfeita
+    # por quem chamou. Assim dois workers nunca vendem a mesma peça.
+    # A UPDATE é o primeiro comando da transação: no modo WAL, uma transação
+    # que já leu e depois tenta escrever falha com "database is locked" se
+    # outro commit entrou no meio, sem respeitar o busy_timeout.
+    quantidade = case(quantidades, value=Produto.id)
+    resultado = db.session.execute(
+        update(Produto)
+        .where(Produto.id.in_(quantidades), Produto.estoque >= quantidade)
+        .values(estoque=Produto.estoque - quantidade)
+        .execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount == len(quantidades):
+        return
+
+    # Só lê os produtos no caminho de erro, para montar a mensagem
+    encontrados = {p.id: p for p in Produto.query.filter(Produto.id.in_(quantidades))}
+    for produto_id, qtd in quantidades.items():
+        produto = encontrados.get(produto_id)
+        if produto is None:
+            raise Exception(f"Produto #{produto_id} não está mais disponível.")
+        if produto.estoque < qtd:
+            raise Exception(f"Estoque insuficiente para '{produto.nome}'. Temos apenas {produto.estoque} un.")
+    raise Exception("Estoque insuficiente para um dos produtos do carrinho.")
+
+
+@bp.route('/checkout', methods=['GET', 'POST'])
 def checkout():
     if 'cliente_id' not in session:
         flash('Você precisa estar logado para finalizar a compra.', 'warning')
-        return redirect(url_for('login'))
+        return redirect(url_for('loja.login'))
 
-    carrinho_session = session.get('carrinho', {})
-    if not carrinho_session:
+    carrinho_atual = _carrinho_atual()
+    if not carrinho_atual:
         flash('Seu carrinho está vazio.', 'info')
-        return redirect(url_for('carrinho'))
-
-    total_carrinho = sum(item['preco'] * item['quantidade'] for item in carrinho_session.values())
-
-    # 🔧 CONVERTER CARRINHO PARA A MESMA ESTRUTURA USADA NO TEMPLATE
-    itens_para_template = []
-    for pid, item in carrinho_session.items():
-        itens_para_template.append({
-            'produto_id': pid,
-            'nome_produto': item['nome'],
-            'preco_unitario': item['preco'],
-            'quantidade': item['quantidade'],
-            'subtotal': item['preco'] * item['quantidade']
-        })
+        return redirect(url_for('loja.carrinho'))
 
     if request.method == 'POST':
         tipo_pagamento = request.form.get('tipo_pagamento')
         cliente_id = session['cliente_id']
 
         try:
-            novo_pedido = Pedido(cliente_id=cliente_id, status='processando')
+            quantidades = carrinho_atual.quantidades()
+            reservar_estoque(quantidades)
+
+            agora = datetime.utcnow()
+            novo_pedido = Pedido(cliente_id=cliente_id, data=agora, status='processando')
             db.session.add(novo_pedido)
             db.session.flush()
-
-            for produto_id_str, item in carrinho_session.items():
-                produto_id = int(produto_id_str)
-                produto = Produto.query.get(produto_id)
-
-                if produto.estoque < item['quantidade']:
-                    raise Exception(f"Estoque insuficiente para '{produto.nome}'. Temos apenas {produto.estoque} un.")
-
-                produto.estoque -= item['quantidade']
-
-                novo_item = ItemPedido(
-                    pedido_id=novo_pedido.id,
-                    produto_id=produto_id,
-                    quantidade=item['quantidade'],
-                    preco_unitario=item['preco']
-                )
-                db.session.add(novo_item)
+            pedido_id = novo_pedido.id
+
+            db.session.execute(insert(AlteracaoCatalogo), [{'produto_id': pid} for pid in quantidades])
+            db.session.execute(insert(ItemPedido), [
+                {
+                    'pedido_id': pedido_id,
+                    'produto_id': item['produto_id'],
+                    'quantidade': item['quantidade'],
+                    'preco_unitario': item['preco_unitario'],
+                }
+                for item in carrinho_atual.itens
+            ])
+            registrar_venda(agora.date(), carrinho_atual.itens)
 
             novo_pagamento = Pagamento(
-                pedido_id=novo_pedido.id,
+                pedido_id=pedido_id,
                 tipo=tipo_pagamento,
-                valor=total_carrinho,
+                valor=carrinho_atual.total,
                 status='processando'
             )
 
             db.session.add(novo_pagamento)
-            session.pop('carrinho', None)
-            session.modified = True
+            # A cobrança em si fica para os workers de pagamento
+            enfileirar(novo_pagamento)
+            # No backend SQLite a limpeza entra no mesmo commit do pedido; no
+            # de memória, só depois dele, para o carrinho sobreviver a um rollback
+            carrinhos = _carrinhos()
+            if carrinhos.transacional:
+                carrinhos.limpar(_carrinho_id())
             db.session.commit()
+            if not carrinhos.transacional:
+                carrinhos.limpar(_carrinho_id())
+            invalidar_produtos(quantidades)
 
             flash('Pedido realizado com sucesso!', 'success')
-            return redirect(url_for('detalhes_pedido', id=novo_pedido.id))
+            return redirect(url_for('loja.detalhes_pedido', id=pedido_id))
 
         except Exception as e:
             db.session.rollback()
             flash(f'Erro ao processar o pedido: {str(e)}', 'danger')
-            return redirect(url_for('checkout'))
+            return redirect(url_for('loja.checkout'))
 
-    return render_template('checkout.html', itens_carrinho=itens_para_template, total_carrinho=total_carrinho)
+    return render_template('checkout.html', itens_carrinho=carrinho_atual.itens, total_carrinho=carrinho_atual.total)
 
 
 
-@app.route('/pedido/<int:id>')
+@bp.route('/pedido/<int:id>')
 def detalhes_pedido(id):
     if 'cliente_id' not in session:
         flash('Faça login para ver seus pedidos.', 'warning')
-        return redirect(url_for('login'))
+        return redirect(url_for('loja.login'))
 
-    pedido = Pedido.query.get_or_404(id)
+    # Pedido, pagamento, itens e produtos num único SELECT com JOINs, em vez
+    # de uma consulta por relação e mais uma por item no template
+    pedido = (Pedido.query
+              .options(joinedload(Pedido.pagamento),
+                       joinedload(Pedido.itens).joinedload(ItemPedido.produto))
+              .filter_by(id=id)
+              .first_or_404())
 
     if pedido.cliente_id != session['cliente_id']:
         flash('Você não tem permissão para ver este pedido.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('loja.index'))
+
+    return render_template('pedido.html', pedido=pedido, pagamento=pedido.pagamento, itens_do_pedido=pedido.itens)
+
+
+@bp.route('/pedidos')
+def historico_pedidos():
+    if 'cliente_id' not in session:
+        flash('Faça login para ver seus pedidos.', 'warning')
+        return redirect(url_for('loja.login'))
+
+    # Mais recentes primeiro; a página seguinte começa antes do último id
+    # mostrado. Totais e quantidade de peças são somados no próprio SELECT.
+    antes = request.args.get('before', type=int)
+    limite = _limite_pagina()
 
-    pagamento = Pagamento.query.filter_by(pedido_id=id).first()
-    itens_do_pedido = ItemPedido.query.filter_by(pedido_id=id).all()
+    filtros = [Pedido.cliente_id == session['cliente_id']]
+    if antes:
+        filtros.append(Pedido.id < antes)
 
-    return render_template('pedido.html', pedido=pedido, pagamento=pagamento, itens_do_pedido=itens_do_pedido)
+    total = db.func.coalesce(db.func.sum(ItemPedido.quantidade * ItemPedido.preco_unitario), 0)
+    consulta = (db.session.query(
+                    Pedido.id, Pedido.data, Pedido.status,
+                    type_coerce(total, db.Numeric(10, 2)).label('total'),
+                    db.func.coalesce(db.func.sum(ItemPedido.quantidade), 0).label('pecas'))
+                .outerjoin(ItemPedido, ItemPedido.pedido_id == Pedido.id)
+                .filter(*filtros)
+                .group_by(Pedido.id)
+                .order_by(Pedido.id.desc())
+                .limit(limite + 1))
 
+    pedidos = consulta.all()
+    proximo = pedidos[limite - 1].id if len(pedidos) > limite else None
 
+    return render_template('pedidos.html', pedidos=pedidos[:limite], proximo=proximo, limite=limite)
 
 if __name__ == '__main__':
+    # Servidor de desenvolvimento: prepara o banco e garante o catálogo padrão
+    app = create_app()
+    with app.app_context():
+        preparar_banco()
+        popular_catalogo()
     app.run(port=5000, host='0.0.0.0')
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from flask import abort, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PASTA_DIST = 'dist'
+MANIFESTO = 'manifest.json'
+# Imagens e fontes já vêm comprimidas; só vale a pena para texto
+COMPRIMIVEIS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.xml'}
+UM_ANO = 365 * 24 * 3600
+
+
+def _hash_arquivo(caminho):
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(65536), b''):
+            sha.update(bloco)
+    return sha.hexdigest()[:12]
+
+
+def construir_assets(pasta_static):
+    """Copia cada arquivo de static/ para static/dist/ com o hash do conteúdo
+    no nome (style.css -> style.3f2a1b9c0d1e.css), grava as versões .gz e
+    .br ao lado e escreve o manifesto usado por `asset_url`."""
+    destino = os.path.join(pasta_static, PASTA_DIST)
+    if os.path.isdir(destino):
+        shutil.rmtree(destino)
+    os.makedirs(destino)
+
+    manifesto = {}
+    for raiz, pastas, arquivos in os.walk(pasta_static):
+        pastas[:] = [p for p in pastas if os.path.join(raiz, p) != destino]
+        for nome in sorted(arquivos):
+            origem = os.path.join(raiz, nome)
+            relativo = os.path.relpath(origem, pasta_static).replace(os.sep, '/')
+            base, extensao = os.path.splitext(relativo)
+            final = f'{base}.{_hash_arquivo(origem)}{extensao}'
+
+            caminho_final = os.path.join(destino, final)
+            os.makedirs(os.path.dirname(caminho_final), exist_ok=True)
+            shutil.copyfile(origem, caminho_final)
+
+            if extensao.lower() in COMPRIMIVEIS:
+                with open(origem, 'rb') as arquivo:
+                    conteudo = arquivo.read()
+                with open(caminho_final + '.gz', 'wb') as arquivo:
+                    arquivo.write(gzip.compress(conteudo, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(caminho_final + '.br', 'wb') as arquivo:
+                        arquivo.write(brotli.compress(conteudo, quality=11))
+            manifesto[relativo] = final
+
+    with open(os.path.join(destino, MANIFESTO), 'w') as arquivo:
+        json.dump(manifesto, arquivo, indent=2, sort_keys=True)
+    return manifesto
+
+
+def carregar_manifesto(pasta_static):
+    try:
+        with open(os.path.join(pasta_static, PASTA_DIST, MANIFESTO)) as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return {}
+
+
+def servir_asset(pasta_static, arquivo, accept_encodings):
+    """Entrega um arquivo com hash no nome, escolhendo a versão comprimida
+    que o navegador aceita. Como o nome muda a cada alteração, a resposta
+    pode ficar em cache para sempre."""
+    pasta = os.path.join(pasta_static, PASTA_DIST)
+    # As versões .gz/.br só saem pela negociação abaixo: pedidas direto,
+    # iriam com o Content-Type do original e sem Content-Encoding
+    if (arquivo == MANIFESTO or arquivo.endswith(('.gz', '.br'))
+            or not os.path.isfile(os.path.join(pasta, arquivo))):
+        abort(404)
+
+    tipo, _ = mimetypes.guess_type(arquivo)
+    codificacao = None
+    for nome, sufixo in (('br', '.br'), ('gzip', '.gz')):
+        if nome in accept_encodings and os.path.isfile(os.path.join(pasta, arquivo + sufixo)):
+            codificacao, arquivo = nome, arquivo + sufixo
+            break
+
+    resposta = send_from_directory(pasta, arquivo, mimetype=tipo or 'application/octet-stream', max_age=UM_ANO)
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    resposta.vary.add('Accept-Encoding')
+    if codificacao:
+        resposta.content_encoding = codificacao
+    return resposta
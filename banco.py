@@ -0,0 +1,97 @@
+from sqlalchemy import event, text
+
+# Perfis de armazenamento do SQLite. O perfil é escolhido por
+# app.config['BANCO_PERFIL'] (ou pela variável STYLEME_BANCO_PERFIL).
+#
+# producao: WAL deixa leituras rodarem em paralelo com a escrita e o
+# busy_timeout faz a conexão esperar pelo lock em vez de falhar na hora
+# com "database is locked". synchronous=NORMAL é seguro com WAL (só o
+# último commit pode se perder numa queda de energia, nunca corrompe).
+PERFIS_BANCO = {
+    'desenvolvimento': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 10,
+    },
+    'producao': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 15000,
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+    },
+}
+
+
+def carregar_perfil(nome):
+    try:
+        return PERFIS_BANCO[nome]
+    except KeyError:
+        raise ValueError(f"Perfil de banco desconhecido: {nome!r}. Use um de {sorted(PERFIS_BANCO)}.")
+
+
+def opcoes_engine(uri, perfil):
+    # Bancos em memória usam um pool de uma conexão por thread e não
+    # aceitam pool_size/max_overflow
+    if uri.endswith(':memory:') or uri in ('sqlite://', 'sqlite:///'):
+        return {}
+    return {
+        'pool_size': perfil['pool_size'],
+        'max_overflow': perfil['max_overflow'],
+        'pool_timeout': perfil['pool_timeout'],
+        'connect_args': {'timeout': perfil['busy_timeout'] / 1000},
+    }
+
+
+def registrar_pragmas(engine, perfil):
+    @event.listens_for(engine, 'connect')
+    def _aplicar_pragmas(conexao_dbapi, _registro):
+        cursor = conexao_dbapi.cursor()
+        cursor.execute(f"PRAGMA journal_mode={perfil['journal_mode']}")
+        cursor.execute(f"PRAGMA synchronous={perfil['synchronous']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(perfil['busy_timeout'])}")
+        cursor.close()
+
+
+# Migrações
+# Cada passo roda uma única vez; a versão aplicada fica gravada no próprio
+# arquivo do banco (PRAGMA user_version). Os comandos usam IF NOT EXISTS
+# para também servirem em bancos novos, já criados pelo create_all.
+MIGRACOES = [
+    (1, 'índices nas chaves estrangeiras usadas em filtros', [
+        "CREATE INDEX IF NOT EXISTS ix_itens_pedido_pedido_id ON itens_pedido (pedido_id)",
+        "CREATE INDEX IF NOT EXISTS ix_pedidos_cliente_id ON pedidos (cliente_id)",
+        "CREATE INDEX IF NOT EXISTS ix_pagamentos_pedido_id ON pagamentos (pedido_id)",
+    ]),
+    (2, 'fila de cobrança para pagamentos que ficaram em processamento', [
+        "INSERT INTO tarefas_pagamento (pagamento_id, status, tentativas, proxima_tentativa_em, criado_em) "
+        "SELECT id, 'pendente', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM pagamentos "
+        "WHERE status = 'processando' AND id NOT IN (SELECT pagamento_id FROM tarefas_pagamento)",
+    ]),
+    (3, 'índice de estoque para o relatório de estoque baixo', [
+        "CREATE INDEX IF NOT EXISTS ix_produtos_estoque ON produtos (estoque)",
+    ]),
+]
+
+
+def versao_banco(db):
+    return db.session.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrar(db):
+    atual = versao_banco(db)
+    aplicadas = []
+    for versao, descricao, comandos in MIGRACOES:
+        if versao <= atual:
+            continue
+        for comando in comandos:
+            db.session.execute(text(comando))
+        # PRAGMA não aceita parâmetros; a versão vem da lista acima
+        db.session.execute(text(f"PRAGMA user_version = {int(versao)}"))
+        db.session.commit()
+        aplicadas.append((versao, descricao))
+    return aplicadas
@@ -0,0 +1,367 @@
+"""Benchmark offline da loja.
+
+Monta um banco sintético (catálogo, clientes e pedidos) num arquivo
+temporário e repete uma carga mista contra a aplicação pelo cliente de
+teste WSGI, sem abrir portas. Com --processos N, cada processo cria a
+própria aplicação sobre o mesmo banco, como os workers do gunicorn.
+
+    python benchmark.py --produtos 5000 --clientes 200 --requisicoes 2000
+    python benchmark.py --processos 4 --saida atual.json
+    python benchmark.py --saida novo.json --comparar atual.json
+
+O relógio só começa quando todos os processos já criaram a aplicação. O
+JSON de saída traz o total de req/s e, por rota: requisições, parcela da
+carga, latência média/p50/p95/p99 em ms e média de comandos SQL por
+requisição.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import tempfile
+import time
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from werkzeug.security import generate_password_hash
+
+from app import create_app, preparar_banco
+from models import db, Cliente, Produto, Pedido, ItemPedido, Pagamento
+
+SENHA = 'benchmark'
+MIX_PADRAO = {
+    'catalogo': 30,
+    'busca': 10,
+    'produto': 25,
+    'carrinho': 15,
+    'login': 5,
+    'checkout': 5,
+    'pedido': 5,
+    'historico': 5,
+}
+PALAVRAS = ['camisa', 'bermuda', 'short', 'jaqueta', 'vestido', 'calça', 'moletom', 'boné',
+            'algodão', 'linho', 'oversized', 'slim', 'estampada', 'lisa', 'preta', 'branca']
+
+
+def _config(args, uri):
+    return {
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'TESTING': True,
+        'SENHA_METODO': args.senha_metodo,
+        # Com 0 o hash roda na thread; > 0 mede o pool de processos de senha
+        'SENHA_PROCESSOS': args.senha_processos,
+    }
+
+
+def montar_dados(args, uri):
+    app = create_app(_config(args, uri))
+    aleatorio = random.Random(args.semente)
+    with app.app_context():
+        preparar_banco()
+
+        produtos = []
+        for i in range(1, args.produtos + 1):
+            nome = ' '.join(aleatorio.sample(PALAVRAS, 3)).title()
+            produtos.append({
+                'id': i,
+                'nome': f'{nome} {i}',
+                'descricao': ' '.join(aleatorio.choices(PALAVRAS, k=12)),
+                'preco': round(aleatorio.uniform(20, 400), 2),
+                'estoque': 10 ** 6,
+                'imagem_url': None,
+            })
+        db.session.execute(insert(Produto), produtos)
+
+        # Um único hash reaproveitado: gerar milhares de scrypt não é o que
+        # queremos medir aqui
+        senha_hash = generate_password_hash(SENHA, method=args.senha_metodo)
+        db.session.execute(insert(Cliente), [
+            {'id': i, 'nome': f'Cliente {i}', 'email': f'cliente{i}@bench.local', 'senha_hash': senha_hash}
+            for i in range(1, args.clientes + 1)
+        ])
+
+        inicio = datetime.utcnow() - timedelta(days=365)
+        pedidos, itens, pagamentos = [], [], []
+        for pedido_id in range(1, args.pedidos + 1):
+            pedidos.append({
+                'id': pedido_id,
+                'cliente_id': aleatorio.randint(1, args.clientes),
+                'data': inicio + timedelta(minutes=aleatorio.randint(0, 365 * 24 * 60)),
+                'status': 'pago',
+            })
+            total = 0
+            for produto in aleatorio.sample(produtos, min(aleatorio.randint(1, args.itens_por_pedido), len(produtos))):
+                quantidade = aleatorio.randint(1, 3)
+                itens.append({'pedido_id': pedido_id, 'produto_id': produto['id'],
+                              'quantidade': quantidade, 'preco_unitario': produto['preco']})
+                total += quantidade * produto['preco']
+            pagamentos.append({'pedido_id': pedido_id, 'tipo': 'pix', 'valor': round(total, 2), 'status': 'aprovado'})
+        if pedidos:
+            db.session.execute(insert(Pedido), pedidos)
+            db.session.execute(insert(ItemPedido), itens)
+            db.session.execute(insert(Pagamento), pagamentos)
+        db.session.commit()
+
+        pedidos_por_cliente = {}
+        for pedido in pedidos:
+            pedidos_por_cliente.setdefault(pedido['cliente_id'], []).append(pedido['id'])
+    return pedidos_por_cliente
+
+
+class UsuarioVirtual:
+    def __init__(self, app, cliente_id, pedidos, args, aleatorio):
+        self.cliente = app.test_client()
+        self.cliente_id = cliente_id
+        self.pedidos = list(pedidos)
+        self.args = args
+        self.aleatorio = aleatorio
+        self.logado = False
+        self.itens_no_carrinho = 0
+
+    def produto_aleatorio(self):
+        return self.aleatorio.randint(1, self.args.produtos)
+
+    # Cada operação devolve a lista de requisições que fez: (rota, função)
+    def catalogo(self):
+        depois = self.aleatorio.choice([0, 0, self.aleatorio.randint(0, self.args.produtos)])
+        return [('catalogo', lambda: self.cliente.get(f'/?after={depois}'))]
+
+    def busca(self):
+        termo = self.aleatorio.choice(PALAVRAS)
+        return [('busca', lambda: self.cliente.get(f'/busca?q={termo}'))]
+
+    def produto(self):
+        produto_id = self.produto_aleatorio()
+        return [('produto', lambda: self.cliente.get(f'/produto/{produto_id}'))]
+
+    def carrinho(self):
+        produto_id = self.produto_aleatorio()
+        self.itens_no_carrinho += 1
+        return [('carrinho', lambda: self.cliente.post('/carrinho', data={'produto_id': produto_id, 'quantidade': 1}))]
+
+    def login(self):
+        self.logado = True
+        email = f'cliente{self.cliente_id}@bench.local'
+        return [('login', lambda: self.cliente.post('/login', data={'email': email, 'senha': SENHA}))]
+
+    def checkout(self):
+        passos = [] if self.logado else self.login()
+        if not self.itens_no_carrinho:
+            passos += self.carrinho()
+        self.itens_no_carrinho = 0
+
+        def finalizar():
+            resposta = self.cliente.post('/checkout', data={'tipo_pagamento': 'pix'})
+            encontrado = re.search(r'/pedido/(\d+)', resposta.headers.get('Location', ''))
+            if encontrado:
+                self.pedidos.append(int(encontrado.group(1)))
+            return resposta
+        return passos + [('checkout', finalizar)]
+
+    def pedido(self):
+        passos = [] if self.logado else self.login()
+        if not self.pedidos:
+            return passos + self.checkout()
+        pedido_id = self.aleatorio.choice(self.pedidos)
+        return passos + [('pedido', lambda: self.cliente.get(f'/pedido/{pedido_id}'))]
+
+    def historico(self):
+        passos = [] if self.logado else self.login()
+        return passos + [('historico', lambda: self.cliente.get('/pedidos'))]
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicao = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[posicao]
+
+
+def executar_worker(parametros, barreira=None):
+    args, uri, pedidos_por_cliente, indice, total_requisicoes = parametros
+    aleatorio = random.Random(args.semente * 1000 + indice)
+    app = create_app(_config(args, uri))
+
+    comandos = [0]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *_: comandos.__setitem__(0, comandos[0] + 1))
+
+    usuarios = []
+    for _ in range(args.usuarios):
+        cliente_id = aleatorio.randint(1, args.clientes)
+        usuarios.append(UsuarioVirtual(app, cliente_id, pedidos_por_cliente.get(cliente_id, []), args, aleatorio))
+
+    operacoes = list(args.mix)
+    pesos = [args.mix[o] for o in operacoes]
+    amostras = {}
+
+    # Espera os outros processos terminarem de subir a aplicação
+    if barreira is not None:
+        barreira.wait()
+    inicio_carga = time.time()
+    feitas = 0
+    while feitas < total_requisicoes:
+        usuario = aleatorio.choice(usuarios)
+        operacao = aleatorio.choices(operacoes, pesos)[0]
+        for rota, requisicao in getattr(usuario, operacao)():
+            comandos[0] = 0
+            inicio = time.perf_counter()
+            resposta = requisicao()
+            duracao = time.perf_counter() - inicio
+            registro = amostras.setdefault(rota, {'latencias': [], 'sql': [], 'erros': 0})
+            registro['latencias'].append(duracao)
+            registro['sql'].append(comandos[0])
+            if resposta.status_code >= 500:
+                registro['erros'] += 1
+            feitas += 1
+    fim_carga = time.time()
+    app.extensions['senhas'].encerrar()
+    return {'amostras': amostras, 'inicio': inicio_carga, 'fim': fim_carga}
+
+
+def _rodar_processo(parametros, barreira, fila):
+    try:
+        fila.put(('ok', executar_worker(parametros, barreira)))
+    except BaseException:
+        # Libera quem estiver esperando na barreira
+        barreira.abort()
+        fila.put(('erro', traceback.format_exc()))
+
+
+def resumir(amostras, duracao):
+    rotas = {}
+    total = 0
+    for rota, registro in sorted(amostras.items()):
+        latencias = registro['latencias']
+        total += len(latencias)
+        rotas[rota] = {
+            'requisicoes': len(latencias),
+            'media_ms': round(sum(latencias) / len(latencias) * 1000, 3),
+            'p50_ms': round(_percentil(latencias, 50) * 1000, 3),
+            'p95_ms': round(_percentil(latencias, 95) * 1000, 3),
+            'p99_ms': round(_percentil(latencias, 99) * 1000, 3),
+            'sql_por_requisicao': round(sum(registro['sql']) / len(registro['sql']), 2),
+            'sql_max': max(registro['sql']),
+            'erros': registro['erros'],
+        }
+    # A carga é mista: req/s por rota seria só a parcela dela no total
+    for dados in rotas.values():
+        dados['parcela_pct'] = round(dados['requisicoes'] / total * 100, 1)
+    return {'requisicoes': total, 'req_por_segundo': round(total / duracao, 2),
+            'duracao_s': round(duracao, 3), 'rotas': rotas}
+
+
+def _variacao(antes, depois):
+    return f'{(depois - antes) / antes * 100:+.0f}%' if antes else 'n/a'
+
+
+def comparar(atual, base):
+    antes, depois = base['resultado']['req_por_segundo'], atual['resultado']['req_por_segundo']
+    print(f'req/s total: {depois:.2f} ({_variacao(antes, depois)})')
+    print(f"{'rota':<12}{'média ms':>18}{'p50 ms':>18}{'p95 ms':>18}{'sql/req':>16}")
+    for rota, dados in atual['resultado']['rotas'].items():
+        anterior = base['resultado']['rotas'].get(rota)
+        if anterior is None:
+            continue
+        colunas = []
+        for campo, largura in (('media_ms', 18), ('p50_ms', 18), ('p95_ms', 18), ('sql_por_requisicao', 16)):
+            if campo not in anterior:
+                colunas.append(f'{dados[campo]:.2f} (n/a)'.rjust(largura))
+                continue
+            colunas.append(f'{dados[campo]:.2f} ({_variacao(anterior[campo], dados[campo])})'.rjust(largura))
+        print(f'{rota:<12}' + ''.join(colunas))
+
+
+def _mix(texto):
+    mix = dict(MIX_PADRAO)
+    for parte in filter(None, texto.split(',')):
+        operacao, _, peso = parte.partition('=')
+        if operacao not in MIX_PADRAO:
+            raise argparse.ArgumentTypeError(f'operação desconhecida: {operacao}')
+        mix[operacao] = float(peso)
+    return {operacao: peso for operacao, peso in mix.items() if peso > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--produtos', type=int, default=2000)
+    parser.add_argument('--clientes', type=int, default=200)
+    parser.add_argument('--pedidos', type=int, default=5000)
+    parser.add_argument('--itens-por-pedido', type=int, default=5)
+    parser.add_argument('--requisicoes', type=int, default=2000, help='total, somando todos os processos')
+    parser.add_argument('--usuarios', type=int, default=20, help='usuários virtuais por processo')
+    parser.add_argument('--processos', type=int, default=1)
+    parser.add_argument('--mix', type=_mix, default=dict(MIX_PADRAO),
+                        help='pesos por operação, ex.: catalogo=50,checkout=0')
+    parser.add_argument('--senha-metodo', default='scrypt:32768:8:1')
+    parser.add_argument('--senha-processos', type=int, default=0,
+                        help='processos de hash por worker (0 = hash na thread do request)')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='grava o resultado em JSON neste arquivo')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparar')
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix='styleme-bench-')
+    uri = 'sqlite:///' + os.path.join(pasta, 'bench.db')
+    try:
+        inicio = time.perf_counter()
+        pedidos_por_cliente = montar_dados(args, uri)
+        print(f'📦 Dados montados em {time.perf_counter() - inicio:.1f}s')
+
+        por_processo = [args.requisicoes // args.processos] * args.processos
+        por_processo[0] += args.requisicoes % args.processos
+        parametros = [(args, uri, pedidos_por_cliente, i, n) for i, n in enumerate(por_processo)]
+
+        if args.processos == 1:
+            resultados = [executar_worker(parametros[0])]
+        else:
+            # Um Process por worker (não Pool): cada um precisa chegar à
+            # barreira, e processos de Pool não podem criar o pool de senhas
+            barreira = multiprocessing.Barrier(args.processos)
+            fila = multiprocessing.Queue()
+            processos = [multiprocessing.Process(target=_rodar_processo, args=(p, barreira, fila))
+                         for p in parametros]
+            for processo in processos:
+                processo.start()
+            respostas = [fila.get() for _ in processos]
+            for processo in processos:
+                processo.join()
+            erros = [detalhe for situacao, detalhe in respostas if situacao == 'erro']
+            if erros:
+                raise SystemExit('Falha num processo do benchmark:\n' + erros[0])
+            resultados = [detalhe for _, detalhe in respostas]
+        duracao = max(r['fim'] for r in resultados) - min(r['inicio'] for r in resultados)
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    amostras = {}
+    for resultado in resultados:
+        for rota, registro in resultado['amostras'].items():
+            destino = amostras.setdefault(rota, {'latencias': [], 'sql': [], 'erros': 0})
+            destino['latencias'] += registro['latencias']
+            destino['sql'] += registro['sql']
+            destino['erros'] += registro['erros']
+
+    relatorio = {
+        'parametros': {chave: valor for chave, valor in vars(args).items() if chave not in ('saida', 'comparar')},
+        'ambiente': {'python': platform.python_version(), 'plataforma': platform.platform(),
+                     'cpus': os.cpu_count()},
+        'resultado': resumir(amostras, duracao),
+    }
+
+    print(json.dumps(relatorio['resultado'], indent=2, ensure_ascii=False))
+    if args.saida:
+        with open(args.saida, 'w') as arquivo:
+            json.dump(relatorio, arquivo, indent=2, ensure_ascii=False, sort_keys=True)
+    if args.comparar:
+        with open(args.comparar) as arquivo:
+            comparar(relatorio, json.load(arquivo))
+
+
+if __name__ == '__main__':
+    main()
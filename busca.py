@@ -0,0 +1,64 @@
+import re
+from sqlalchemy import text
+
+# Índice FTS5 "external content": o texto fica só em `produtos`, o índice
+# guarda apenas os tokens. Os triggers mantêm os dois em sincronia.
+# O trigger de UPDATE só dispara quando nome/descrição mudam, então as
+# baixas de estoque do checkout não tocam no índice.
+_DDL_BUSCA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+        nome, descricao,
+        content='produtos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_ai AFTER INSERT ON produtos BEGIN
+        INSERT INTO produtos_fts(rowid, nome, descricao) VALUES (new.id, new.nome, new.descricao);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_ad AFTER DELETE ON produtos BEGIN
+        INSERT INTO produtos_fts(produtos_fts, rowid, nome, descricao) VALUES ('delete', old.id, old.nome, old.descricao);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_au AFTER UPDATE OF nome, descricao ON produtos BEGIN
+        INSERT INTO produtos_fts(produtos_fts, rowid, nome, descricao) VALUES ('delete', old.id, old.nome, old.descricao);
+        INSERT INTO produtos_fts(rowid, nome, descricao) VALUES (new.id, new.nome, new.descricao);
+    END
+    """,
+]
+
+
+def criar_indice_busca(db):
+    existia = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'produtos_fts'"
+    )).first() is not None
+
+    for ddl in _DDL_BUSCA:
+        db.session.execute(text(ddl))
+
+    # Bancos antigos já têm produtos cadastrados antes do índice existir
+    if not existia:
+        db.session.execute(text("INSERT INTO produtos_fts(produtos_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def montar_consulta(termo):
+    # Cada palavra vira um prefixo entre aspas, assim a entrada do usuário
+    # nunca é interpretada como sintaxe do FTS5 (AND, NEAR, aspas soltas...)
+    palavras = re.findall(r'\w+', termo or '')
+    return ' '.join(f'"{p}"*' for p in palavras)
+
+
+def buscar_ids(db, termo, depois=0, limite=24):
+    consulta = montar_consulta(termo)
+    if not consulta:
+        return []
+    linhas = db.session.execute(text(
+        "SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH :consulta AND rowid > :depois "
+        "ORDER BY rowid LIMIT :limite"
+    ), {'consulta': consulta, 'depois': depois, 'limite': limite})
+    return [linha[0] for linha in linhas]
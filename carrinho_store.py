@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, CarrinhoItem
+
+
+class Carrinho:
+    """Itens de um carrinho já no formato dos templates, com o total
+    calculado uma única vez."""
+
+    def __init__(self, itens):
+        self.itens = []
+        self.total = Decimal('0')
+        for produto_id, item in sorted(itens.items()):
+            preco = Decimal(str(item['preco']))
+            subtotal = preco * item['quantidade']
+            self.itens.append({
+                'produto_id': produto_id,
+                'nome_produto': item['nome'],
+                'preco_unitario': preco,
+                'quantidade': item['quantidade'],
+                'subtotal': subtotal,
+            })
+            self.total += subtotal
+
+    def __bool__(self):
+        return bool(self.itens)
+
+    def quantidades(self):
+        return {item['produto_id']: item['quantidade'] for item in self.itens}
+
+
+# Backends
+# Todos têm a mesma interface: obter, adicionar, limpar. O backend SQLite
+# escreve na transação atual e quem chama decide quando fazer commit, o que
+# permite limpar o carrinho no mesmo commit que grava o pedido.
+
+class CarrinhoSQLite:
+    # As escritas entram na transação da sessão e voltam atrás com ela
+    transacional = True
+
+    def __init__(self, ttl_segundos):
+        self.ttl_segundos = ttl_segundos
+
+    def obter(self, carrinho_id):
+        linhas = CarrinhoItem.query.filter_by(carrinho_id=carrinho_id).all()
+        return Carrinho({
+            linha.produto_id: {'nome': linha.nome, 'preco': linha.preco, 'quantidade': linha.quantidade}
+            for linha in linhas
+        })
+
+    def adicionar(self, carrinho_id, produto_id, nome, preco, quantidade):
+        comando = sqlite_insert(CarrinhoItem).values(
+            carrinho_id=carrinho_id, produto_id=produto_id, nome=nome,
+            preco=preco, quantidade=quantidade, atualizado_em=datetime.utcnow(),
+        )
+        comando = comando.on_conflict_do_update(
+            index_elements=[CarrinhoItem.carrinho_id, CarrinhoItem.produto_id],
+            set_={
+                'quantidade': CarrinhoItem.quantidade + comando.excluded.quantidade,
+                'atualizado_em': comando.excluded.atualizado_em,
+            },
+        )
+        db.session.execute(comando)
+
+    def limpar(self, carrinho_id):
+        CarrinhoItem.query.filter_by(carrinho_id=carrinho_id).delete(synchronize_session=False)
+
+    def expirar(self):
+        # O TTL vale para o carrinho inteiro: uma linha antiga sobrevive
+        # enquanto outra do mesmo carrinho tiver sido mexida há pouco
+        limite = datetime.utcnow() - timedelta(seconds=self.ttl_segundos)
+        abandonados = (db.session.query(CarrinhoItem.carrinho_id)
+                       .group_by(CarrinhoItem.carrinho_id)
+                       .having(db.func.max(CarrinhoItem.atualizado_em) < limite))
+        return (CarrinhoItem.query.filter(CarrinhoItem.carrinho_id.in_(abandonados.scalar_subquery()))
+                .delete(synchronize_session=False))
+
+
+class CarrinhoMemoria:
+    # Só serve para um processo (desenvolvimento ou um único worker):
+    # cada worker teria os seus próprios carrinhos.
+    # Escritas valem na hora, sem rollback: limpar só depois do commit.
+    transacional = False
+
+    def __init__(self, ttl_segundos, max_carrinhos):
+        self.ttl_segundos = ttl_segundos
+        self.max_carrinhos = max_carrinhos
+        self._carrinhos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _vivo(self, carrinho_id, agora):
+        registro = self._carrinhos.get(carrinho_id)
+        if registro is None:
+            return None
+        expira_em, itens = registro
+        if expira_em < agora:
+            del self._carrinhos[carrinho_id]
+            return None
+        return itens
+
+    def obter(self, carrinho_id):
+        with self._lock:
+            itens = self._vivo(carrinho_id, time.monotonic())
+            return Carrinho(dict(itens) if itens else {})
+
+    def adicionar(self, carrinho_id, produto_id, nome, preco, quantidade):
+        with self._lock:
+            agora = time.monotonic()
+            itens = self._vivo(carrinho_id, agora) or {}
+            if produto_id in itens:
+                item = itens[produto_id]
+                itens[produto_id] = {**item, 'quantidade': item['quantidade'] + quantidade}
+            else:
+                itens[produto_id] = {'nome': nome, 'preco': preco, 'quantidade': quantidade}
+            self._carrinhos[carrinho_id] = (agora + self.ttl_segundos, itens)
+            self._carrinhos.move_to_end(carrinho_id)
+            self._despejar(agora)
+
+    def limpar(self, carrinho_id):
+        with self._lock:
+            self._carrinhos.pop(carrinho_id, None)
+
+    def expirar(self):
+        with self._lock:
+            return self._despejar(time.monotonic())
+
+    def _despejar(self, agora):
+        # A ordem é a do último uso, então os expirados estão no começo
+        removidos = 0
+        while self._carrinhos:
+            carrinho_id, (expira_em, _) = next(iter(self._carrinhos.items()))
+            if expira_em >= agora and len(self._carrinhos) <= self.max_carrinhos:
+                break
+            del self._carrinhos[carrinho_id]
+            removidos += 1
+        return removidos
+
+
+def criar_carrinho_store(config):
+    backend = config['CARRINHO_BACKEND']
+    if backend == 'sqlite':
+        return CarrinhoSQLite(ttl_segundos=config['CARRINHO_TTL_SEGUNDOS'])
+    if backend == 'memoria':
+        return CarrinhoMemoria(ttl_segundos=config['CARRINHO_TTL_SEGUNDOS'],
+                               max_carrinhos=config['CARRINHO_MAX_MEMORIA'])
+    raise ValueError(f"Backend de carrinho desconhecido: {backend!r}. Use 'sqlite' ou 'memoria'.")
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+class CatalogoCache:
+    """Cache read-through do catálogo, com tamanho máximo (LRU) e versão.
+
+    Cada invalidação incrementa a versão; uma carga que começou antes de uma
+    invalidação não grava o resultado, evitando devolver estoque antigo.
+    """
+
+    def __init__(self, max_itens=512):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.versao = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Último id de AlteracaoCatalogo já aplicado (sincronização entre workers)
+        self.ultima_alteracao = None
+        # Momento da última invalidação, usado como Last-Modified das páginas
+        self.alterado_em = datetime.now(timezone.utc)
+
+    def obter(self, chave, carregar):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                return self._itens[chave]
+            self.misses += 1
+            versao = self.versao
+
+        valor = carregar()
+        if valor is None:
+            return None
+
+        with self._lock:
+            if versao == self.versao:
+                self._itens[chave] = valor
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+                    self.evictions += 1
+        return valor
+
+    def invalidar(self, *chaves):
+        # Sem chaves, descarta o catálogo inteiro (ex.: após reseed)
+        with self._lock:
+            self.versao += 1
+            self.alterado_em = datetime.now(timezone.utc)
+            if not chaves:
+                self._itens.clear()
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def invalidar_grupo(self, grupo, *chaves):
+        # Remove todas as chaves do grupo (ex.: todas as páginas da listagem)
+        # e mais as chaves avulsas informadas, numa única troca de versão
+        with self._lock:
+            self.versao += 1
+            self.alterado_em = datetime.now(timezone.utc)
+            for chave in [c for c in self._itens if c[0] == grupo]:
+                del self._itens[chave]
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'versao': self.versao,
+                'itens': len(self._itens),
+                'max_itens': self.max_itens,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,92 @@
+from sqlalchemy import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Produto, AlteracaoCatalogo
+
+# Os ids são fixos para que popular o catálogo seja idempotente: rodar de
+# novo atualiza as mesmas linhas em vez de duplicar produtos.
+PRODUTOS_PADRAO = [
+    {
+        'id': 1,
+        'nome': "Camisa Blessed Streetwear",
+        'descricao': "Uma camiseta de algodão confortável",
+        'preco': 79.90,
+        'estoque': 50,
+        'imagem_url': "https://down-br.img.susercontent.com/file/sg-11134201-7rat0-mayzkhimuclt34@resize_w450_nl.webp",
+    },
+    {
+        'id': 2,
+        'nome': "Camisas Oversized Astronauta",
+        'descricao': "Apresentamos a Camiseta Unissex Oversized, confeccionada em 100% algodão. Com um corte amplo e folgado, essa peça é fabricada com materiais de alta qualidade, garantindo durabilidade excepcional. ",
+        'preco': 79.90,
+        'estoque': 100,
+        'imagem_url': "https://down-br.img.susercontent.com/file/br-11134207-7r98p-llwc0bzzkx6e33.webp",
+    },
+    {
+        'id': 3,
+        'nome': "Bermuda Short Osascorte",
+        'descricao': "Short",
+        'preco': 50.00,
+        'estoque': 30,
+        'imagem_url': "https://down-br.img.susercontent.com/file/br-11134207-7r98o-m4rtb8evd2v55c.webp",
+    },
+    {
+        'id': 4,
+        'nome': "Short Bermuda Exclusive",
+        'descricao': "Apresentamos a você o nosso incrível Short ",
+        'preco': 55.00,
+        'estoque': 30,
+        'imagem_url': "https://down-br.img.susercontent.com/file/sg-11134201-7rfgy-m9uvb7pjp4mh94.webp",
+    },
+]
+
+
+def popular_catalogo(produtos=None, repor_estoque=False):
+    """Insere ou atualiza os produtos num único INSERT ... ON CONFLICT.
+
+    O estoque de produtos que já existem é preservado, a não ser que
+    `repor_estoque` seja verdadeiro.
+    """
+    produtos = PRODUTOS_PADRAO if produtos is None else produtos
+    if not produtos:
+        return 0
+
+    comando = sqlite_insert(Produto).values(produtos)
+    colunas = ['nome', 'descricao', 'preco', 'imagem_url']
+    if repor_estoque:
+        colunas.append('estoque')
+    comando = comando.on_conflict_do_update(
+        index_elements=[Produto.id],
+        set_={coluna: comando.excluded[coluna] for coluna in colunas},
+    )
+    db.session.execute(comando)
+
+    # Avisa os caches de todos os workers; as alterações anteriores deixam
+    # de ser necessárias, pois o marcador já invalida o catálogo inteiro
+    marcador = db.session.execute(
+        insert(AlteracaoCatalogo).values(produto_id=None).returning(AlteracaoCatalogo.id)
+    ).scalar()
+    db.session.query(AlteracaoCatalogo).filter(AlteracaoCatalogo.id < marcador).delete(synchronize_session=False)
+    db.session.commit()
+    return len(produtos)
+
+
+def compactar_alteracoes(manter=1000):
+    """Apaga o registro de alterações, menos as `manter` mais recentes.
+
+    As linhas apagadas viram um marcador de catálogo inteiro com o id da
+    última delas: um worker que ainda não tinha lido alguma dessas linhas
+    limpa o cache todo; quem já passou desse id não percebe nada.
+    """
+    ultima = (db.session.query(AlteracaoCatalogo.id)
+              .order_by(AlteracaoCatalogo.id.desc())
+              .offset(manter)
+              .limit(1)
+              .scalar())
+    if ultima is None:
+        return 0
+    removidas = (db.session.query(AlteracaoCatalogo)
+                 .filter(AlteracaoCatalogo.id <= ultima)
+                 .delete(synchronize_session=False))
+    db.session.execute(insert(AlteracaoCatalogo).values(id=ultima, produto_id=None))
+    db.session.commit()
+    return removidas - 1
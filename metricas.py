@@ -0,0 +1,305 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, has_request_context, request, current_app, before_render_template, template_rendered, request_finished
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import event
+
+# Métricas por request, no formato texto do Prometheus. Os valores ficam na
+# memória de cada processo. Com vários workers, defina METRICAS_DIRETORIO:
+# cada worker grava ali um arquivo com o seu estado e o /metrics soma todos,
+# como o modo multiprocesso do prometheus_client. Arquivos de workers que já
+# morreram continuam somando nos contadores (que assim nunca voltam para
+# trás); limpe o diretório só quando reiniciar o serviço inteiro.
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKETS_QUANTIDADE = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, buckets, rotulo='endpoint'):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.buckets = tuple(buckets)
+        self.rotulo = rotulo
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, endpoint, valor):
+        posicao = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(endpoint)
+            if serie is None:
+                serie = self._series[endpoint] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][posicao] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def estado(self):
+        with self._lock:
+            return {endpoint: [list(c), s, n] for endpoint, (c, s, n) in self._series.items()}
+
+    def exportar(self, estados=None):
+        # `estados` são os estado() de cada worker, somados série a série
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        series = {}
+        for estado in (self.estado(),) if estados is None else estados:
+            for endpoint, (contagens, soma, total) in estado.items():
+                if endpoint not in series:
+                    series[endpoint] = ([0] * len(contagens), 0.0, 0)
+                c, s, n = series[endpoint]
+                series[endpoint] = ([a + b for a, b in zip(c, contagens)], s + soma, n + total)
+        for endpoint, (contagens, soma, total) in sorted(series.items()):
+            rotulo = f'{self.rotulo}="{_escapar(endpoint)}"'
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens):
+                acumulado += contagem
+                linhas.append(f'{self.nome}_bucket{{{rotulo},le="{limite}"}} {acumulado}')
+            linhas.append(f'{self.nome}_bucket{{{rotulo},le="+Inf"}} {total}')
+            linhas.append(f'{self.nome}_sum{{{rotulo}}} {soma}')
+            linhas.append(f'{self.nome}_count{{{rotulo}}} {total}')
+        return linhas
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metricas:
+    def __init__(self, diretorio=None, intervalo_gravacao=1.0):
+        self.duracao = Histograma('styleme_request_duration_seconds', 'Tempo total do request.', BUCKETS_SEGUNDOS)
+        self.sql_quantidade = Histograma('styleme_sql_queries', 'Comandos SQL por request.', BUCKETS_QUANTIDADE)
+        self.sql_tempo = Histograma('styleme_sql_duration_seconds', 'Tempo somado em SQL por request.', BUCKETS_SEGUNDOS)
+        self.sql_mais_lento = Histograma('styleme_sql_slowest_seconds', 'Comando SQL mais lento do request.', BUCKETS_SEGUNDOS)
+        self.render = Histograma('styleme_template_render_seconds', 'Tempo renderizando templates Jinja por request.', BUCKETS_SEGUNDOS)
+        self.sessao = Histograma('styleme_session_save_seconds', 'Tempo serializando e assinando a sessão.', BUCKETS_SEGUNDOS)
+        self.tamanho = Histograma('styleme_response_size_bytes', 'Tamanho do corpo da resposta.', BUCKETS_BYTES)
+        self.histogramas = [self.duracao, self.sql_quantidade, self.sql_tempo, self.sql_mais_lento,
+                            self.render, self.sessao, self.tamanho]
+        self._status = {}
+        self._lock = threading.Lock()
+        # Funções sem argumentos que devolvem métricas simples
+        # (nome, 'counter' ou 'gauge', ajuda, valor), lidas a cada exportação
+        self.coletores = []
+        self.diretorio = diretorio
+        self.intervalo_gravacao = intervalo_gravacao
+        self._arquivo = None
+        self._pid = None
+        self._pendente = False
+        self._gravando = threading.Lock()
+        self._thread_pid = None
+
+    def registrar(self, endpoint, status, dados, total, tamanho):
+        self.duracao.observar(endpoint, total)
+        self.sql_quantidade.observar(endpoint, dados['sql_n'])
+        self.sql_tempo.observar(endpoint, dados['sql_t'])
+        self.sql_mais_lento.observar(endpoint, dados['sql_max'])
+        self.render.observar(endpoint, dados['render_t'])
+        self.sessao.observar(endpoint, dados['sessao_t'])
+        self.tamanho.observar(endpoint, tamanho)
+        with self._lock:
+            self._status[(endpoint, status)] = self._status.get((endpoint, status), 0) + 1
+            self._pendente = True
+
+    def estado(self):
+        with self._lock:
+            status = [[endpoint, codigo, total] for (endpoint, codigo), total in self._status.items()]
+        return {
+            'pid': os.getpid(),
+            'histogramas': {h.nome: h.estado() for h in self.histogramas},
+            'status': status,
+            'extras': [list(extra) for coletor in self.coletores for extra in coletor()],
+        }
+
+    def agendar_gravacao(self):
+        # Gravar custa ~1ms, então não acontece no request: uma thread de
+        # cada processo grava o que mudou a cada `intervalo_gravacao` segundos
+        if not self.diretorio or self._thread_pid == os.getpid():
+            return
+        with self._gravando:
+            if self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                threading.Thread(target=self._gravar_periodicamente, daemon=True).start()
+
+    def _gravar_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo_gravacao)
+            self.gravar()
+
+    def gravar(self, forcar=False):
+        """Grava o estado deste processo em METRICAS_DIRETORIO, se algo mudou
+        desde a última gravação (ou sempre, com forcar=True)."""
+        if not self.diretorio or not (self._pendente or forcar):
+            return
+        with self._gravando:
+            if self._pid != os.getpid():
+                # O nome inclui o horário para um pid reaproveitado não
+                # sobrescrever os contadores de um worker que já morreu
+                self._pid = os.getpid()
+                self._arquivo = os.path.join(self.diretorio, f'metricas_{self._pid}_{time.time_ns()}.json')
+            self._pendente = False
+            temporario = self._arquivo + '.tmp'
+            with open(temporario, 'w') as arquivo:
+                json.dump(self.estado(), arquivo)
+            os.replace(temporario, self._arquivo)
+
+    def _estados(self):
+        if not self.diretorio:
+            return [self.estado()]
+        self.gravar(forcar=True)
+        estados = []
+        for caminho in sorted(glob.glob(os.path.join(self.diretorio, 'metricas_*.json'))):
+            try:
+                with open(caminho) as arquivo:
+                    estados.append(json.load(arquivo))
+            except (OSError, ValueError):
+                continue
+        return estados
+
+    def exportar(self):
+        estados = self._estados()
+        linhas = []
+        for histograma in self.histogramas:
+            linhas += histograma.exportar([e['histogramas'].get(histograma.nome, {}) for e in estados])
+
+        status = {}
+        extras = {}
+        for estado in estados:
+            for endpoint, codigo, total in estado['status']:
+                status[(endpoint, codigo)] = status.get((endpoint, codigo), 0) + total
+            # Contadores somam todos os workers; gauges só os que estão vivos
+            vivo = estado['pid'] == os.getpid() or _processo_vivo(estado['pid'])
+            for nome, tipo, ajuda, valor in estado['extras']:
+                if tipo == 'gauge' and not vivo:
+                    continue
+                extras.setdefault(nome, [tipo, ajuda, 0])[2] += valor
+
+        linhas += ['# HELP styleme_requests_total Requests por endpoint e status.',
+                   '# TYPE styleme_requests_total counter']
+        for (endpoint, codigo), total in sorted(status.items()):
+            linhas.append(f'styleme_requests_total{{endpoint="{_escapar(endpoint)}",status="{codigo}"}} {total}')
+        for nome, (tipo, ajuda, valor) in extras.items():
+            linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}', f'{nome} {valor}']
+        return '\n'.join(linhas) + '\n'
+
+
+class SessaoCronometrada(SecureCookieSessionInterface):
+    # A sessão é salva depois dos after_request, então o tempo é medido aqui
+    def save_session(self, app, session, response):
+        inicio = time.perf_counter()
+        try:
+            return super().save_session(app, session, response)
+        finally:
+            dados = g.get('_metricas') if has_request_context() else None
+            if dados is not None:
+                dados['sessao_t'] += time.perf_counter() - inicio
+
+
+def _dados():
+    return g.get('_metricas') if has_request_context() else None
+
+
+def _iniciar():
+    g._metricas = {'inicio': time.perf_counter(), 'sql_n': 0, 'sql_t': 0.0, 'sql_max': 0.0,
+                   'sql_lento': None, 'render_t': 0.0, 'render_inicio': None, 'sessao_t': 0.0}
+
+
+def _antes_sql(conexao, cursor, comando, parametros, contexto, executemany):
+    conexao.info.setdefault('_metricas_inicio', []).append(time.perf_counter())
+
+
+def _depois_sql(conexao, cursor, comando, parametros, contexto, executemany):
+    duracao = time.perf_counter() - conexao.info['_metricas_inicio'].pop()
+    dados = _dados()
+    if dados is None:
+        return
+    dados['sql_n'] += 1
+    dados['sql_t'] += duracao
+    if duracao > dados['sql_max']:
+        dados['sql_max'] = duracao
+        dados['sql_lento'] = comando
+
+
+def _erro_sql(contexto):
+    # Comando que falhou não passa pelo after_cursor_execute
+    conexao = contexto.connection
+    if conexao is not None and conexao.info.get('_metricas_inicio'):
+        conexao.info['_metricas_inicio'].pop()
+
+
+def _antes_render(app, template, context, **extra):
+    dados = _dados()
+    if dados is not None:
+        dados['render_inicio'] = time.perf_counter()
+
+
+def _depois_render(app, template, context, **extra):
+    dados = _dados()
+    if dados is not None and dados['render_inicio'] is not None:
+        dados['render_t'] += time.perf_counter() - dados['render_inicio']
+        dados['render_inicio'] = None
+
+
+def _finalizar(app, response, **extra):
+    dados = _dados()
+    if dados is None:
+        return
+    total = time.perf_counter() - dados['inicio']
+    endpoint = request.endpoint or 'sem_rota'
+    tamanho = response.content_length or 0
+    metricas = app.extensions['metricas']
+    metricas.registrar(endpoint, response.status_code, dados, total, tamanho)
+    metricas.agendar_gravacao()
+
+    if app.config['METRICAS_CABECALHO']:
+        response.headers['Server-Timing'] = (
+            f'total;dur={total * 1000:.2f}, '
+            f'sql;dur={dados["sql_t"] * 1000:.2f};desc="{dados["sql_n"]} comandos", '
+            f'render;dur={dados["render_t"] * 1000:.2f}, '
+            f'sessao;dur={dados["sessao_t"] * 1000:.2f}'
+        )
+
+    lento_ms = app.config['METRICAS_LENTO_MS']
+    if lento_ms is not None and total * 1000 >= lento_ms:
+        comando = ' '.join((dados['sql_lento'] or '').split())[:200]
+        app.logger.warning(
+            'Request lento: %s %s (%s) %.1fms | sql %d comandos %.1fms, mais lento %.1fms: %s | render %.1fms | %d bytes',
+            request.method, request.path, endpoint, total * 1000, dados['sql_n'], dados['sql_t'] * 1000,
+            dados['sql_max'] * 1000, comando, dados['render_t'] * 1000, tamanho)
+
+
+def instalar_metricas(app, engine):
+    diretorio = app.config['METRICAS_DIRETORIO']
+    if diretorio:
+        os.makedirs(diretorio, exist_ok=True)
+    metricas = app.extensions['metricas'] = Metricas(diretorio, app.config['METRICAS_INTERVALO_GRAVACAO'])
+    if diretorio:
+        # Requests do último intervalo antes de o worker sair
+        atexit.register(metricas.gravar)
+    app.session_interface = SessaoCronometrada()
+    app.before_request(_iniciar)
+    event.listen(engine, 'before_cursor_execute', _antes_sql)
+    event.listen(engine, 'after_cursor_execute', _depois_sql)
+    event.listen(engine, 'handle_error', _erro_sql)
+    before_render_template.connect(_antes_render, app)
+    template_rendered.connect(_depois_render, app)
+    request_finished.connect(_finalizar, app)
+
+
+def exportar_metricas():
+    return current_app.extensions['metricas'].exportar()
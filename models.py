@@ -0,0 +1,116 @@
+from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+from senhas import gerar_hash, verificar_hash, hash_desatualizado
+
+db = SQLAlchemy()
+
+
+# Banco de dados
+
+class Cliente(db.Model):
+    __tablename__ = 'clientes'
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False)
+    email = db.Column(db.String(100), unique=True, nullable=False)
+    senha_hash = db.Column(db.String(255), nullable=False)
+    telefone = db.Column(db.String(20))
+    pedidos = db.relationship('Pedido', backref='cliente', lazy=True)
+
+    def set_senha(self, senha):
+        self.senha_hash = gerar_hash(senha)
+
+    def check_senha(self, senha):
+        return verificar_hash(self.senha_hash, senha)
+
+    def senha_desatualizada(self):
+        return hash_desatualizado(self.senha_hash)
+
+
+class Produto(db.Model):
+    __tablename__ = 'produtos'
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False)
+    descricao = db.Column(db.Text)
+    preco = db.Column(db.Numeric(10, 2), nullable=False)
+    estoque = db.Column(db.Integer, nullable=False, default=0, index=True)
+    imagem_url = db.Column(db.String(500), nullable=True)
+
+
+class Pedido(db.Model):
+    __tablename__ = 'pedidos'
+    id = db.Column(db.Integer, primary_key=True)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False, index=True)
+    data = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='pendente')
+    itens = db.relationship('ItemPedido', backref='pedido', lazy=True)
+    pagamento = db.relationship('Pagamento', backref='pedido', uselist=False, lazy=True)
+
+
+class ItemPedido(db.Model):
+    __tablename__ = 'itens_pedido'
+    id = db.Column(db.Integer, primary_key=True)
+    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id'), nullable=False, index=True)
+    produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id'), nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False)
+    preco_unitario = db.Column(db.Numeric(10, 2), nullable=False)
+    produto = db.relationship('Produto', lazy=True)
+
+
+class Pagamento(db.Model):
+    __tablename__ = 'pagamentos'
+    id = db.Column(db.Integer, primary_key=True)
+    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id'), nullable=False, index=True)
+    tipo = db.Column(db.String(50))
+    valor = db.Column(db.Numeric(10, 2), nullable=False)
+    status = db.Column(db.String(20), default='aguardando')
+
+
+class AlteracaoCatalogo(db.Model):
+    # Registro das mudanças de estoque/catálogo. Cada processo guarda o
+    # último id que já viu e, a cada request do catálogo, invalida no seu
+    # cache só os produtos alterados por outros workers desde então.
+    # produto_id NULL significa "catálogo inteiro" (ex.: após popular).
+    __tablename__ = 'catalogo_alteracoes'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    produto_id = db.Column(db.Integer, nullable=True)
+
+
+class CarrinhoItem(db.Model):
+    # Carrinho guardado no servidor; o cookie de sessão só leva o carrinho_id
+    __tablename__ = 'carrinho_itens'
+    carrinho_id = db.Column(db.String(32), primary_key=True)
+    produto_id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False)
+    preco = db.Column(db.Numeric(10, 2), nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class TarefaPagamento(db.Model):
+    # Fila de cobranças, gravada no banco para sobreviver a reinícios.
+    # Os workers de `flask processar-pagamentos` reservam lotes de tarefas
+    # pendentes; `bloqueado_ate` devolve a tarefa à fila se o worker morrer.
+    __tablename__ = 'tarefas_pagamento'
+    __table_args__ = (db.Index('ix_tarefas_pagamento_fila', 'status', 'proxima_tentativa_em'),)
+    id = db.Column(db.Integer, primary_key=True)
+    pagamento_id = db.Column(db.Integer, db.ForeignKey('pagamentos.id'), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default='pendente')
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    bloqueado_ate = db.Column(db.DateTime)
+    worker = db.Column(db.String(100))
+    ultimo_erro = db.Column(db.String(500))
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    pagamento = db.relationship('Pagamento', lazy=True)
+
+
+class VendaDiaria(db.Model):
+    # Totais de vendas por dia e produto, mantidos pelo checkout (e estornados
+    # quando o pagamento cancela o pedido). Relatórios leem só o intervalo
+    # pedido pela chave primária, sem varrer itens_pedido.
+    __tablename__ = 'vendas_diarias'
+    dia = db.Column(db.Date, primary_key=True)
+    produto_id = db.Column(db.Integer, primary_key=True)
+    unidades = db.Column(db.Integer, nullable=False, default=0)
+    receita = db.Column(db.Numeric(12, 2), nullable=False, default=0)
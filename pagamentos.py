@@ -0,0 +1,253 @@
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import and_, insert, or_, select, update
+from werkzeug.utils import import_string
+from models import db, Pagamento, Pedido, ItemPedido, Produto, TarefaPagamento, AlteracaoCatalogo
+from relatorios import estornar_venda
+
+logger = logging.getLogger(__name__)
+
+APROVADO = 'aprovado'
+RECUSADO = 'recusado'
+
+
+class GatewayIndisponivel(Exception):
+    """Falha temporária (timeout, 5xx...): a cobrança volta para a fila."""
+
+
+@dataclass
+class Cobranca:
+    pagamento_id: int
+    pedido_id: int
+    tipo: str
+    valor: object
+    # O gateway deve usar esta chave para não cobrar duas vezes se a mesma
+    # tarefa for repetida (worker que morreu depois de cobrar, por exemplo)
+    chave_idempotencia: str
+
+
+class Gateway:
+    """Interface dos gateways de pagamento. `cobrar` devolve APROVADO ou
+    RECUSADO, ou levanta GatewayIndisponivel para tentar de novo depois."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def cobrar(self, cobranca):
+        raise NotImplementedError
+
+
+class GatewayLocal(Gateway):
+    """Gateway de mentira para desenvolvimento e testes.
+
+    PAGAMENTO_LOCAL_LATENCIA simula o tempo de resposta (segundos),
+    PAGAMENTO_LOCAL_FALHAS a fração de chamadas que falham temporariamente e
+    PAGAMENTO_LOCAL_LIMITE o valor acima do qual a cobrança é recusada.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.latencia = config.get('PAGAMENTO_LOCAL_LATENCIA', 0.0)
+        self.falhas = config.get('PAGAMENTO_LOCAL_FALHAS', 0.0)
+        self.limite = config.get('PAGAMENTO_LOCAL_LIMITE')
+        self.cobradas = {}
+
+    def cobrar(self, cobranca):
+        if cobranca.chave_idempotencia in self.cobradas:
+            return self.cobradas[cobranca.chave_idempotencia]
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.falhas and random.random() < self.falhas:
+            raise GatewayIndisponivel('falha simulada')
+        resultado = RECUSADO if self.limite is not None and cobranca.valor > self.limite else APROVADO
+        self.cobradas[cobranca.chave_idempotencia] = resultado
+        return resultado
+
+
+def criar_gateway(config):
+    return import_string(config['PAGAMENTO_GATEWAY'])(config)
+
+
+def enfileirar(pagamento):
+    # Chamado dentro da transação do checkout: a tarefa só existe se o pedido existir
+    tarefa = TarefaPagamento(pagamento=pagamento, status='pendente', proxima_tentativa_em=datetime.utcnow())
+    db.session.add(tarefa)
+    return tarefa
+
+
+class ProcessadorPagamentos:
+    def __init__(self, gateway, lote, lease_segundos, max_tentativas, espera_base, espera_maxima, worker=None):
+        self.gateway = gateway
+        self.lote = lote
+        self.lease_segundos = lease_segundos
+        self.max_tentativas = max_tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+
+    def reservar_lote(self):
+        # Um único UPDATE ... RETURNING marca o lote como deste worker. O SQLite
+        # serializa escritas, então dois workers nunca pegam a mesma tarefa.
+        agora = datetime.utcnow()
+        disponiveis = (
+            select(TarefaPagamento.id)
+            .where(or_(
+                and_(TarefaPagamento.status == 'pendente', TarefaPagamento.proxima_tentativa_em <= agora),
+                and_(TarefaPagamento.status == 'processando', TarefaPagamento.bloqueado_ate < agora),
+            ))
+            .order_by(TarefaPagamento.id)
+            .limit(self.lote)
+        )
+        reservadas = db.session.execute(
+            update(TarefaPagamento)
+            .where(TarefaPagamento.id.in_(disponiveis.scalar_subquery()))
+            .values(status='processando', worker=self.worker,
+                    bloqueado_ate=agora + timedelta(seconds=self.lease_segundos),
+                    tentativas=TarefaPagamento.tentativas + 1)
+            .returning(TarefaPagamento.id, TarefaPagamento.pagamento_id, TarefaPagamento.tentativas)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        return reservadas
+
+    def processar_lote(self):
+        reservadas = self.reservar_lote()
+        if not reservadas:
+            return 0
+
+        cobrancas = {
+            p.id: Cobranca(pagamento_id=p.id, pedido_id=p.pedido_id, tipo=p.tipo, valor=p.valor,
+                           chave_idempotencia=f'pagamento-{p.id}')
+            for p in Pagamento.query.filter(Pagamento.id.in_([r.pagamento_id for r in reservadas]))
+        }
+        # A chamada ao gateway acontece fora de qualquer transação, para não
+        # segurar conexão nem lock do SQLite enquanto espera a resposta
+        db.session.commit()
+
+        # Cada tarefa renova o próprio lease logo antes de ser cobrada e tem o
+        # resultado gravado logo depois: com gateway lento, as últimas do lote
+        # não vencem enquanto as primeiras são cobradas
+        for tarefa_id, pagamento_id, tentativas in reservadas:
+            if not self._renovar_lease(tarefa_id):
+                continue
+            cobranca = cobrancas[pagamento_id]
+            repetir = False
+            try:
+                resultado, erro = self.gateway.cobrar(cobranca), None
+            except GatewayIndisponivel as e:
+                logger.warning('Falha ao cobrar pagamento %s (tentativa %s): %s', pagamento_id, tentativas, e)
+                resultado, erro, repetir = None, str(e)[:500], True
+            except Exception as e:
+                # Erro que não é do gateway (bug, resposta inesperada): repetir
+                # não resolve, então a tarefa falha de vez
+                logger.exception('Erro inesperado ao cobrar pagamento %s', pagamento_id)
+                resultado, erro = None, repr(e)[:500]
+            self._aplicar(tarefa_id, cobranca, tentativas, resultado, erro, repetir)
+            db.session.commit()
+        return len(reservadas)
+
+    def _renovar_lease(self, tarefa_id):
+        renovada = db.session.execute(update(TarefaPagamento)
+                                      .where(TarefaPagamento.id == tarefa_id,
+                                             TarefaPagamento.worker == self.worker,
+                                             TarefaPagamento.status == 'processando')
+                                      .values(bloqueado_ate=datetime.utcnow() + timedelta(seconds=self.lease_segundos))
+                                      .execution_options(synchronize_session=False))
+        db.session.commit()
+        return renovada.rowcount > 0
+
+    def _aplicar(self, tarefa_id, cobranca, tentativas, resultado, erro, repetir=False):
+        # Cada UPDATE só vale a partir do estado esperado, então repetir o
+        # mesmo resultado (ou chegar atrasado depois do lease) não muda nada
+        minha = and_(TarefaPagamento.id == tarefa_id, TarefaPagamento.worker == self.worker,
+                     TarefaPagamento.status == 'processando')
+
+        if resultado is None and repetir and tentativas < self.max_tentativas:
+            espera = min(self.espera_base * 2 ** (tentativas - 1), self.espera_maxima)
+            db.session.execute(update(TarefaPagamento).where(minha).values(
+                status='pendente', bloqueado_ate=None, ultimo_erro=erro,
+                proxima_tentativa_em=datetime.utcnow() + timedelta(seconds=espera)
+            ).execution_options(synchronize_session=False))
+            return
+
+        status_tarefa = 'falhou' if resultado is None else 'concluida'
+        atualizada = db.session.execute(update(TarefaPagamento).where(minha).values(
+            status=status_tarefa, bloqueado_ate=None, ultimo_erro=erro
+        ).execution_options(synchronize_session=False))
+        if atualizada.rowcount == 0:
+            return
+
+        status_pagamento = {APROVADO: 'aprovado', RECUSADO: 'recusado', None: 'erro'}[resultado]
+        db.session.execute(update(Pagamento)
+                           .where(Pagamento.id == cobranca.pagamento_id, Pagamento.status == 'processando')
+                           .values(status=status_pagamento)
+                           .execution_options(synchronize_session=False))
+
+        status_pedido = 'pago' if resultado == APROVADO else 'cancelado'
+        pedido = db.session.execute(update(Pedido)
+                                    .where(Pedido.id == cobranca.pedido_id, Pedido.status == 'processando')
+                                    .values(status=status_pedido)
+                                    .execution_options(synchronize_session=False))
+        if pedido.rowcount and status_pedido == 'cancelado':
+            devolver_estoque(cobranca.pedido_id)
+            estornar_venda(cobranca.pedido_id)
+
+
+def devolver_estoque(pedido_id):
+    # Pedido cancelado libera o estoque reservado no checkout
+    quantidade = (select(db.func.sum(ItemPedido.quantidade))
+                  .where(ItemPedido.pedido_id == pedido_id, ItemPedido.produto_id == Produto.id)
+                  .scalar_subquery())
+    produtos = select(ItemPedido.produto_id).where(ItemPedido.pedido_id == pedido_id)
+    db.session.execute(update(Produto)
+                       .where(Produto.id.in_(produtos))
+                       .values(estoque=Produto.estoque + quantidade)
+                       .execution_options(synchronize_session=False))
+    db.session.execute(insert(AlteracaoCatalogo).from_select(['produto_id'], produtos.distinct()))
+
+
+def criar_processador(config):
+    return ProcessadorPagamentos(
+        gateway=criar_gateway(config),
+        lote=config['PAGAMENTO_LOTE'],
+        lease_segundos=config['PAGAMENTO_LEASE_SEGUNDOS'],
+        max_tentativas=config['PAGAMENTO_MAX_TENTATIVAS'],
+        espera_base=config['PAGAMENTO_ESPERA_BASE'],
+        espera_maxima=config['PAGAMENTO_ESPERA_MAXIMA'],
+    )
+
+
+def executar_worker(criar_app, intervalo, uma_vez=False):
+    """Laço de um worker: processa lotes até a fila esvaziar e então dorme
+    `intervalo` segundos. Termina com SIGTERM/Ctrl+C depois do lote atual."""
+    app = criar_app()
+    parar = []
+    signal.signal(signal.SIGTERM, lambda *_: parar.append(True))
+
+    with app.app_context():
+        processador = criar_processador(app.config)
+        try:
+            while not parar:
+                try:
+                    processados = processador.processar_lote()
+                except Exception:
+                    # Erro de banco (database is locked...) não derruba o
+                    # worker: as tarefas reservadas voltam quando o lease vencer
+                    logger.exception('Falha ao processar lote de pagamentos')
+                    db.session.rollback()
+                    time.sleep(intervalo)
+                    continue
+                if uma_vez and not processados:
+                    break
+                if not processados:
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            db.session.remove()
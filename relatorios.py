@@ -0,0 +1,142 @@
+import csv
+import io
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Pedido, ItemPedido, Produto, VendaDiaria
+
+
+COLUNAS = ['dia', 'produto_id', 'unidades', 'receita']
+
+# Mesma estrutura de vendas_diarias; reconstruir_vendas monta os totais
+# aqui e só no fim troca o conteúdo das duas
+_RECONSTRUCAO = VendaDiaria.__table__.to_metadata(db.MetaData(), name='vendas_diarias_reconstrucao')
+
+
+def _somar(comando, tabela=VendaDiaria.__table__):
+    # Upsert que acumula: a linha (dia, produto) é criada ou somada
+    return comando.on_conflict_do_update(
+        index_elements=[tabela.c.dia, tabela.c.produto_id],
+        set_={
+            'unidades': tabela.c.unidades + comando.excluded.unidades,
+            'receita': tabela.c.receita + comando.excluded.receita,
+        },
+    )
+
+
+def registrar_venda(dia, itens):
+    """Soma os itens de um pedido novo no dia dele. Roda na transação do checkout."""
+    linhas = [
+        {'dia': dia, 'produto_id': item['produto_id'], 'unidades': item['quantidade'],
+         'receita': item['preco_unitario'] * item['quantidade']}
+        for item in itens
+    ]
+    db.session.execute(_somar(sqlite_insert(VendaDiaria).values(linhas)))
+
+
+def _vendas_por_dia_e_produto(sinal, *filtros):
+    quantidade = db.func.sum(ItemPedido.quantidade)
+    return (select(db.func.date(Pedido.data).label('dia'),
+                   ItemPedido.produto_id,
+                   (quantidade * sinal).label('unidades'),
+                   (db.func.sum(ItemPedido.quantidade * ItemPedido.preco_unitario) * sinal).label('receita'))
+            .join(Pedido, Pedido.id == ItemPedido.pedido_id)
+            .where(*filtros)
+            .group_by(db.func.date(Pedido.data), ItemPedido.produto_id))
+
+
+def estornar_venda(pedido_id):
+    """Desconta um pedido cancelado dos totais do dia em que foi feito."""
+    origem = _vendas_por_dia_e_produto(-1, ItemPedido.pedido_id == pedido_id)
+    db.session.execute(_somar(sqlite_insert(VendaDiaria).from_select(COLUNAS, origem)))
+
+
+def _somar_pedidos(tabela, *filtros):
+    origem = _vendas_por_dia_e_produto(1, Pedido.status != 'cancelado', *filtros)
+    db.session.execute(_somar(sqlite_insert(tabela).from_select(COLUNAS, origem), tabela))
+
+
+def reconstruir_vendas(lote=1000):
+    """Refaz a tabela a partir do histórico, em lotes de `lote` pedidos.
+
+    Os lotes são somados numa tabela à parte, que substitui vendas_diarias
+    numa única transação no fim: até lá os relatórios continuam com os
+    números antigos, e se o comando parar no meio nada muda (a próxima
+    execução recomeça do zero). Rode com os workers de pagamento parados
+    para que nenhum cancelamento aconteça no meio.
+    Gera o id do último pedido de cada lote, para acompanhar o progresso.
+    """
+    conexao = db.session.connection()
+    _RECONSTRUCAO.drop(conexao, checkfirst=True)
+    _RECONSTRUCAO.create(conexao)
+    ultimo = db.session.query(db.func.max(Pedido.id)).scalar() or 0
+    db.session.commit()
+
+    inicio = 0
+    while inicio < ultimo:
+        fim = (db.session.query(Pedido.id)
+               .filter(Pedido.id > inicio, Pedido.id <= ultimo)
+               .order_by(Pedido.id)
+               .offset(lote - 1)
+               .limit(1)
+               .scalar()) or ultimo
+        _somar_pedidos(_RECONSTRUCAO, Pedido.id > inicio, Pedido.id <= fim)
+        db.session.commit()
+        inicio = fim
+        yield fim
+
+    # Pedidos feitos durante a reconstrução já foram somados pelo checkout na
+    # tabela antiga; entram aqui na nova. O primeiro comando já pega o lock
+    # de escrita, então nenhum checkout cai entre ele e a troca.
+    _somar_pedidos(_RECONSTRUCAO, Pedido.id > ultimo)
+    db.session.execute(delete(VendaDiaria))
+    db.session.execute(insert(VendaDiaria).from_select(COLUNAS, select(*[_RECONSTRUCAO.c[c] for c in COLUNAS])))
+    _RECONSTRUCAO.drop(db.session.connection())
+    db.session.commit()
+
+
+# Consultas
+# Todas filtram vendas_diarias pelo intervalo de dias, que é o começo da
+# chave primária: o custo acompanha o intervalo, não o total de pedidos.
+
+def receita_por_dia(inicio, fim):
+    linhas = (db.session.query(VendaDiaria.dia,
+                               db.func.sum(VendaDiaria.unidades),
+                               db.func.sum(VendaDiaria.receita))
+              .filter(VendaDiaria.dia.between(inicio, fim))
+              .group_by(VendaDiaria.dia)
+              .order_by(VendaDiaria.dia)
+              .all())
+    return [{'dia': dia.isoformat(), 'unidades': unidades, 'receita': round(float(receita), 2)}
+            for dia, unidades, receita in linhas]
+
+
+def mais_vendidos(inicio, fim, limite):
+    unidades = db.func.sum(VendaDiaria.unidades).label('unidades')
+    linhas = (db.session.query(VendaDiaria.produto_id, Produto.nome, unidades, db.func.sum(VendaDiaria.receita))
+              .outerjoin(Produto, Produto.id == VendaDiaria.produto_id)
+              .filter(VendaDiaria.dia.between(inicio, fim))
+              .group_by(VendaDiaria.produto_id)
+              .having(unidades > 0)
+              .order_by(unidades.desc())
+              .limit(limite)
+              .all())
+    return [{'produto_id': produto_id, 'nome': nome, 'unidades': total, 'receita': round(float(receita), 2)}
+            for produto_id, nome, total, receita in linhas]
+
+
+def estoque_baixo(limiar, limite):
+    linhas = (db.session.query(Produto.id, Produto.nome, Produto.estoque)
+              .filter(Produto.estoque <= limiar)
+              .order_by(Produto.estoque, Produto.id)
+              .limit(limite)
+              .all())
+    return [{'produto_id': produto_id, 'nome': nome, 'estoque': estoque} for produto_id, nome, estoque in linhas]
+
+
+def para_csv(linhas):
+    saida = io.StringIO()
+    if linhas:
+        escritor = csv.DictWriter(saida, fieldnames=list(linhas[0]))
+        escritor.writeheader()
+        escritor.writerows(linhas)
+    return saida.getvalue()
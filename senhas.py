@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app, has_app_context
+from metricas import BUCKETS_SEGUNDOS, Histograma
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+
+def _prefixo_do_metodo(metodo):
+    # O werkzeug completa formas curtas ('scrypt' vira 'scrypt:32768:8:1') e
+    # grava o resultado no começo do hash; aqui a expansão é a mesma, sem
+    # precisar calcular um hash só para descobrir o prefixo
+    nome, *args = metodo.split(':')
+    if nome == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if nome == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return metodo
+
+
+class PoolSenhasOcupado(Exception):
+    """Todas as vagas da fila de hash estão ocupadas; o request deve ser recusado."""
+
+
+class PoolSenhas:
+    """Executa o scrypt/pbkdf2 em processos separados.
+
+    O número de tarefas em andamento é limitado por um semáforo: quando a
+    fila enche, quem chega espera no máximo `espera_maxima` segundos e depois
+    recebe PoolSenhasOcupado, em vez de acumular requests presos no worker.
+    Com processos=0 o hash roda na própria thread (útil em testes).
+
+    A thread do request continua esperando o resultado; o ganho vem de rodar
+    o servidor com várias threads por worker (gunicorn --threads), para que
+    as outras threads sigam atendendo o catálogo enquanto o hash roda. O
+    limite vale por worker: no total são workers × processos hashes ao mesmo
+    tempo.
+    """
+
+    def __init__(self, metodo, processos, max_pendentes, espera_maxima):
+        self.metodo = metodo
+        self.prefixo = _prefixo_do_metodo(metodo)
+        self.processos = processos
+        self.max_pendentes = max_pendentes
+        self.espera_maxima = espera_maxima
+        self._vagas = threading.BoundedSemaphore(max_pendentes)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.pendentes = 0
+        self.pendentes_max = 0
+        self.concluidos = 0
+        self.rejeitados = 0
+        self.tempo_total = 0.0
+        self.tempo_max = 0.0
+        self.latencia = Histograma('styleme_senha_duration_seconds',
+                                   'Tempo de cada hash de senha, incluindo a espera por um processo livre.',
+                                   BUCKETS_SEGUNDOS, rotulo='operacao')
+
+    def _obter_executor(self):
+        # Cria o pool no próprio processo: se o worker veio de um fork depois
+        # de o pool existir, os processos filhos herdados não servem
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.processos)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _descartar_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _executar(self, operacao, funcao, *args, **kwargs):
+        if not self._vagas.acquire(timeout=self.espera_maxima):
+            with self._lock:
+                self.rejeitados += 1
+            raise PoolSenhasOcupado()
+
+        inicio = time.perf_counter()
+        with self._lock:
+            self.pendentes += 1
+            self.pendentes_max = max(self.pendentes_max, self.pendentes)
+        try:
+            if not self.processos:
+                return funcao(*args, **kwargs)
+            executor = self._obter_executor()
+            try:
+                return executor.submit(funcao, *args, **kwargs).result()
+            except BrokenProcessPool:
+                # Um filho morreu (OOM killer, por exemplo) e o pool não se
+                # recupera sozinho: descarta, recria e tenta uma vez mais
+                self._descartar_executor(executor)
+            executor = self._obter_executor()
+            try:
+                return executor.submit(funcao, *args, **kwargs).result()
+            except BrokenProcessPool:
+                self._descartar_executor(executor)
+                raise PoolSenhasOcupado()
+        finally:
+            duracao = time.perf_counter() - inicio
+            with self._lock:
+                self.pendentes -= 1
+                self.concluidos += 1
+                self.tempo_total += duracao
+                self.tempo_max = max(self.tempo_max, duracao)
+            self.latencia.observar(operacao, duracao)
+            self._vagas.release()
+
+    def gerar(self, senha):
+        return self._executar('gerar', generate_password_hash, senha, method=self.metodo)
+
+    def verificar(self, senha_hash, senha):
+        return self._executar('verificar', check_password_hash, senha_hash, senha)
+
+    def desatualizado(self, senha_hash):
+        # O hash do werkzeug começa com os parâmetros usados: "scrypt:32768:8:1$sal$hash"
+        return senha_hash.split('$', 1)[0] != self.prefixo
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'metodo': self.metodo,
+                'processos': self.processos,
+                'max_pendentes': self.max_pendentes,
+                'pendentes': self.pendentes,
+                'pendentes_max': self.pendentes_max,
+                'concluidos': self.concluidos,
+                'rejeitados': self.rejeitados,
+                'latencia_media_ms': round(self.tempo_total / self.concluidos * 1000, 2) if self.concluidos else 0.0,
+                'latencia_max_ms': round(self.tempo_max * 1000, 2),
+            }
+
+    def encerrar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def criar_pool_senhas(config):
+    processos = config['SENHA_PROCESSOS']
+    return PoolSenhas(
+        metodo=config['SENHA_METODO'],
+        processos=processos,
+        max_pendentes=config['SENHA_MAX_PENDENTES'] or max(processos, 1) * 4,
+        espera_maxima=config['SENHA_ESPERA_MAXIMA'],
+    )
+
+
+def _pool():
+    if has_app_context():
+        return current_app.extensions['senhas']
+    return None
+
+
+# Usadas pelo modelo Cliente. Fora de um app (scripts, shell) o hash roda
+# na hora, com os parâmetros padrão do werkzeug.
+
+def gerar_hash(senha):
+    pool = _pool()
+    return pool.gerar(senha) if pool else generate_password_hash(senha)
+
+
+def verificar_hash(senha_hash, senha):
+    pool = _pool()
+    return pool.verificar(senha_hash, senha) if pool else check_password_hash(senha_hash, senha)
+
+
+def hash_desatualizado(senha_hash):
+    pool = _pool()
+    return pool.desatualizado(senha_hash) if pool else False
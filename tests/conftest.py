@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, preparar_banco  # noqa: E402
+from catalogo_padrao import popular_catalogo  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'loja.db'),
+        'BANCO_PERFIL': 'desenvolvimento',
+        'SENHA_METODO': 'pbkdf2:sha256:1000',
+        'SENHA_PROCESSOS': 0,
+        'METRICAS_DIRETORIO': None,
+    })
+    with app.app_context():
+        preparar_banco()
+        popular_catalogo()
+    yield app
+    app.extensions['senhas'].encerrar()
+
+
+@pytest.fixture
+def cliente(app):
+    cliente = app.test_client()
+    cliente.post('/registrar', data={'nome': 'Teste', 'email': 'teste@loja.local', 'senha': 'segredo'})
+    cliente.post('/login', data={'email': 'teste@loja.local', 'senha': 'segredo'})
+    return cliente
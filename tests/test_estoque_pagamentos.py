@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import reservar_estoque
+from models import db, Pedido, Pagamento, Produto, TarefaPagamento, VendaDiaria
+from pagamentos import APROVADO, RECUSADO, Cobranca, criar_processador
+
+
+def _definir_estoque(produto_id, estoque):
+    db.session.get(Produto, produto_id).estoque = estoque
+    db.session.commit()
+
+
+def _estoque(produto_id):
+    db.session.expire_all()
+    return db.session.get(Produto, produto_id).estoque
+
+
+def _comprar(cliente, produto_id, quantidade):
+    cliente.post('/carrinho', data={'produto_id': produto_id, 'quantidade': quantidade})
+    with cliente.session_transaction() as sessao:
+        sessao.pop('_flashes', None)
+    return cliente.post('/checkout', data={'tipo_pagamento': 'pix'})
+
+
+def _mensagens(cliente):
+    with cliente.session_transaction() as sessao:
+        return [mensagem for _, mensagem in sessao.get('_flashes', [])]
+
+
+# reservar_estoque
+
+def test_reserva_decrementa_todos_os_produtos(app):
+    with app.app_context():
+        reservar_estoque({1: 2, 2: 5})
+        db.session.commit()
+        assert _estoque(1) == 48
+        assert _estoque(2) == 95
+
+
+def test_reserva_sem_estoque_nao_vende_nenhum_item(app):
+    with app.app_context():
+        _definir_estoque(1, 2)
+        with pytest.raises(Exception, match=r"Estoque insuficiente para 'Camisa Blessed Streetwear'\. Temos apenas 2 un\."):
+            reservar_estoque({2: 1, 1: 3})
+        db.session.rollback()
+        assert _estoque(1) == 2
+        assert _estoque(2) == 100
+
+
+def test_reserva_de_produto_inexistente(app):
+    with app.app_context():
+        with pytest.raises(Exception, match=r'Produto #999 não está mais disponível\.'):
+            reservar_estoque({1: 1, 999: 1})
+        db.session.rollback()
+        assert _estoque(1) == 50
+
+
+def test_reservas_em_sequencia_param_quando_acaba(app):
+    with app.app_context():
+        _definir_estoque(1, 10)
+        vendidos = 0
+        for _ in range(16):
+            try:
+                reservar_estoque({1: 3})
+                db.session.commit()
+                vendidos += 1
+            except Exception:
+                db.session.rollback()
+        assert vendidos == 3
+        assert _estoque(1) == 1
+
+
+def test_reservas_concorrentes_nao_vendem_alem_do_estoque(app):
+    with app.app_context():
+        _definir_estoque(1, 10)
+
+    def tentar(_):
+        with app.app_context():
+            try:
+                reservar_estoque({1: 3})
+                db.session.commit()
+                return True
+            except Exception:
+                db.session.rollback()
+                return False
+
+    with ThreadPoolExecutor(8) as executor:
+        resultados = list(executor.map(tentar, range(16)))
+
+    with app.app_context():
+        assert resultados.count(True) == 3
+        assert _estoque(1) == 1
+
+
+def test_checkout_sem_estoque_mostra_mensagem_e_nao_cria_pedido(app, cliente):
+    with app.app_context():
+        _definir_estoque(3, 1)
+    resposta = _comprar(cliente, 3, 2)
+    assert resposta.location.endswith('/checkout')
+    assert _mensagens(cliente) == [
+        "Erro ao processar o pedido: Estoque insuficiente para 'Bermuda Short Osascorte'. Temos apenas 1 un."]
+    with app.app_context():
+        assert Pedido.query.count() == 0
+        assert _estoque(3) == 1
+
+
+# Transições de pagamento
+
+def _cobranca_do_pedido(pedido_id):
+    pagamento = Pagamento.query.filter_by(pedido_id=pedido_id).one()
+    return Cobranca(pagamento_id=pagamento.id, pedido_id=pedido_id, tipo=pagamento.tipo,
+                    valor=pagamento.valor, chave_idempotencia=f'pagamento-{pagamento.id}')
+
+
+def _situacao(pedido_id):
+    db.session.expire_all()
+    pedido = db.session.get(Pedido, pedido_id)
+    pagamento = Pagamento.query.filter_by(pedido_id=pedido_id).one()
+    tarefa = TarefaPagamento.query.filter_by(pagamento_id=pagamento.id).one()
+    vendas = [(v.produto_id, v.unidades) for v in VendaDiaria.query.order_by(VendaDiaria.produto_id)]
+    return pedido.status, pagamento.status, tarefa.status, tarefa.tentativas, _estoque(1), vendas
+
+
+@pytest.mark.parametrize('resultado, status_pedido, estoque', [(APROVADO, 'pago', 48), (RECUSADO, 'cancelado', 50)])
+def test_aplicar_repetido_nao_muda_nada(app, cliente, resultado, status_pedido, estoque):
+    _comprar(cliente, 1, 2)
+    with app.app_context():
+        processador = criar_processador(app.config)
+        (tarefa_id, _, tentativas), = processador.reservar_lote()
+        cobranca = _cobranca_do_pedido(1)
+
+        processador._aplicar(tarefa_id, cobranca, tentativas, resultado, None)
+        db.session.commit()
+        depois_da_primeira = _situacao(1)
+        assert depois_da_primeira[0] == status_pedido
+        assert depois_da_primeira[4] == estoque
+
+        for _ in range(3):
+            processador._aplicar(tarefa_id, cobranca, tentativas, resultado, None)
+            db.session.commit()
+        assert _situacao(1) == depois_da_primeira
+
+        # O resultado oposto chegando atrasado também é ignorado
+        oposto = RECUSADO if resultado == APROVADO else APROVADO
+        processador._aplicar(tarefa_id, cobranca, tentativas, oposto, None)
+        db.session.commit()
+        assert _situacao(1) == depois_da_primeira
+
+
+def test_aplicar_de_outro_worker_e_ignorado(app, cliente):
+    _comprar(cliente, 1, 2)
+    with app.app_context():
+        processador = criar_processador(app.config)
+        (tarefa_id, _, tentativas), = processador.reservar_lote()
+        antes = _situacao(1)
+
+        atrasado = criar_processador(app.config)
+        atrasado.worker = 'outro-worker'
+        atrasado._aplicar(tarefa_id, _cobranca_do_pedido(1), tentativas, RECUSADO, None)
+        db.session.commit()
+        assert _situacao(1) == antes
@@ -0,0 +1,23 @@
+"""Ponto de entrada WSGI para produção.
+
+Prepare o banco uma vez, antes de subir os workers:
+
+    flask --app wsgi migrar
+    flask --app wsgi popular-catalogo
+    flask --app wsgi assets
+
+Depois suba quantos processos quiser, por exemplo com gunicorn:
+
+    gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 wsgi:app
+
+Cada worker cria a própria aplicação ao importar este módulo, sem abrir
+conexões nem escrever no banco, então aumentar -w é seguro.
+
+Use --threads (worker gthread): o request de login espera o hash da senha,
+que roda em STYLEME_SENHA_PROCESSOS processos à parte; com uma thread só, o
+worker inteiro ficaria parado nesse tempo. Cada worker tem o seu pool, então
+mantenha -w × STYLEME_SENHA_PROCESSOS perto do número de núcleos.
+"""
+from app import create_app
+
+app = create_app()